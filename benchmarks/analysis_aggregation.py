@@ -0,0 +1,107 @@
+"""Compare the pandas and aggregation pipeline paths of /top and /voice.
+
+Fills a scratch database on DB_ADDRESS with a synthetic guild and times
+both implementations on it. Run from the repository root:
+
+    python -m benchmarks.analysis_aggregation --messages 1000000
+"""
+import argparse
+import datetime
+import random
+import string
+import time
+
+import pandas as pd
+import pymongo
+from config import DB_ADDRESS
+from modules.db_indexes import ensure_indexes
+from modules.message_analysis import user_scores_pipeline, voice_activity_pipeline
+
+GUILD_ID = 1
+
+
+def fill(db, messages, users, sessions, batch_size=10000):
+    words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(1, 10)))
+             for _ in range(1000)]
+    for start in range(0, messages, batch_size):
+        db["messages"].insert_many([{
+            "guild_id": GUILD_ID,
+            "author_id": random.randrange(users),
+            "is_bot": random.random() < 0.05,
+            "channel_id": random.randrange(10),
+            "content": ' '.join(random.choices(words, k=random.randint(1, 20))),
+            "attachments_number": int(random.random() < 0.1)
+        } for _ in range(min(batch_size, messages - start))], ordered=False)
+    for start in range(0, sessions, batch_size):
+        db["voice_activity"].insert_many([{
+            "guild_id": GUILD_ID,
+            "user_id": random.randrange(users),
+            "activity_minutes": random.random() * 120,
+            "session_active": False
+        } for _ in range(min(batch_size, sessions - start))], ordered=False)
+
+
+def scores_pandas(db):
+    df = pd.DataFrame(list(db["messages"].find(
+        {"guild_id": GUILD_ID, "is_bot": False},
+        ["author_id", "content", "attachments_number"])))
+    df["length"] = df["content"].apply(lambda x: len(x))
+    df["score"] = df["length"] * 0.1 + df["attachments_number"] * 5
+    return df.groupby(["author_id"]).sum(numeric_only=True).sort_values(
+        "score", ascending=False).head(10)
+
+
+def scores_pipeline(db):
+    pipeline = user_scores_pipeline(GUILD_ID) + [{"$sort": {"score": -1}}, {"$limit": 10}]
+    return list(db["messages"].aggregate(pipeline, allowDiskUse=True))
+
+
+def voice_pandas(db):
+    df = pd.DataFrame(list(db["voice_activity"].find(
+        {"guild_id": GUILD_ID}, ["user_id", "activity_minutes"])))
+    return df.groupby(["user_id"]).sum(numeric_only=True).sort_values(
+        "activity_minutes", ascending=False).head(10)
+
+
+def voice_pipeline(db):
+    return list(db["voice_activity"].aggregate(voice_activity_pipeline(GUILD_ID, datetime.datetime.utcnow())))
+
+
+def measure(name, func, db, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(db)
+        timings.append(time.perf_counter() - start)
+    print(f"{name:<20} best {min(timings):8.3f} s, mean {sum(timings) / repeat:8.3f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="TabaBotBenchmark")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help="don't drop the database afterwards")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(DB_ADDRESS)
+    db = client[args.database]
+    if db["messages"].estimated_document_count() != args.messages:
+        client.drop_database(args.database)
+        print(f"generating {args.messages} messages and {args.sessions} voice sessions...")
+        fill(db, args.messages, args.users, args.sessions)
+    ensure_indexes(db)
+
+    measure("top (pandas)", scores_pandas, db, args.repeat)
+    measure("top (pipeline)", scores_pipeline, db, args.repeat)
+    measure("voice (pandas)", voice_pandas, db, args.repeat)
+    measure("voice (pipeline)", voice_pipeline, db, args.repeat)
+
+    if not args.keep:
+        client.drop_database(args.database)
+
+
+if __name__ == "__main__":
+    main()
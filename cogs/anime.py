@@ -8,7 +8,9 @@ from nextcord import Embed, File
 from nextcord.ext import commands
 from PIL import Image
 from saucenao_api import AIOSauceNao
-from config import SAFETY, SAUCENAO_TOKEN
+from config import REACTION_REGISTRY_SIZE, SAFETY, SAUCENAO_TOKEN, STATE_DB_PATH
+from modules.message_registry import open_registry
+from modules.state_store import open_store
 
 
 if SAFETY:
@@ -136,11 +138,9 @@ async def send_sauce_nao(message, sauce, characters=None):
     embed.add_field(name="Similarity:", value=f"{sauce.similarity}%", inline=True)
     if characters is not None and len(characters) > 0:
         embed.add_field(name="Characters:", value=characters, inline=False)
-    if SAFETY and is_nsfw(sauce.thumbnail) and not message.channel.nsfw:
-        await message.reply(embed=embed)
-        return
-    embed.set_thumbnail(url=sauce.thumbnail)
-    await message.reply(embed=embed)
+    if not (SAFETY and is_nsfw(sauce.thumbnail) and not message.channel.nsfw):
+        embed.set_thumbnail(url=sauce.thumbnail)
+    return await message.reply(embed=embed)
 
 
 class AnimeCog(commands.Cog, name="Anime Search Engine"):
@@ -161,17 +161,22 @@ class AnimeCog(commands.Cog, name="Anime Search Engine"):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.registry = open_registry(open_store(STATE_DB_PATH), REACTION_REGISTRY_SIZE)
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
-        channel = self.bot.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
         try:
             demojized = emoji.demojize(payload.emoji.name)
         except TypeError:
             demojized = None
+        # only the author's question mark on their own message is handled, checked before fetching
+        if demojized != ":red_question_mark:" or payload.user_id == self.bot.user.id or \
+                self.registry.get(payload.message_id) is not None:
+            return
+        channel = self.bot.get_channel(payload.channel_id)
+        message = await channel.fetch_message(payload.message_id)
 
-        if not message.author.bot and message.author.id == payload.user_id and demojized == ":red_question_mark:":
+        if not message.author.bot and message.author.id == payload.user_id:
             url = get_url(message)
             if url is not None:
                 await channel.trigger_typing()
@@ -192,7 +197,11 @@ class AnimeCog(commands.Cog, name="Anime Search Engine"):
                 if tr_sim - snao_sim > -2:
                     await send_trace_moe(message, trace, characters)
                 else:
-                    await send_sauce_nao(message, sauce, characters)
+                    reply = await send_sauce_nao(message, sauce, characters)
+                    if sauce.index_id == 5:
+                        # the pixiv cog handles reactions on the result, except deleting and editing it
+                        self.registry.add(reply.id, 'pixiv',
+                                          {'illust': sauce.raw['data']['pixiv_id'], 'locked': True})
 
 
 def setup(bot):
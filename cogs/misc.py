@@ -2,14 +2,16 @@ import json
 import random
 import urllib.request
 from datetime import datetime, timezone
+from io import BytesIO
 
-from nextcord import Embed, slash_command
+from nextcord import Embed, File, Member, SlashOption, slash_command
+from nextcord.colour import Colour
 from nextcord.ext import commands
 import git
-import pymongo
 import constants
-from config import DB_ADDRESS, DB_NAME
+from config import DB_ADDRESS, DB_MAX_POOL_SIZE, DB_NAME, DB_WORKERS
 from modules.message_analysis import AnalysisModule
+from modules.mongo import connect
 
 
 start_time = datetime.now()
@@ -98,7 +100,8 @@ async def reference_reaction(ctx, client):
 
 class MiscCog(commands.Cog):
     def __init__(self, bot):
-        self.db = pymongo.MongoClient(DB_ADDRESS)[DB_NAME]
+        self.db = connect(DB_ADDRESS, DB_NAME, max_pool_size=DB_MAX_POOL_SIZE,
+                          max_workers=DB_WORKERS)
         self.client = bot
         self.analyzer = AnalysisModule(self.client, self.db)
 
@@ -113,7 +116,18 @@ class MiscCog(commands.Cog):
         await random.choice(stupid_things)(ctx)
 
         await self.client.process_commands(ctx)
-        self.analyzer.save_message(ctx)
+        await self.analyzer.save_message(ctx)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        self.analyzer.voice_tracker.update(member, before, after)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self.analyzer.voice_tracker.sync(self.client.guilds)
+
+    def cog_unload(self):
+        self.analyzer.close()
 
     @slash_command(name='info')
     async def send_start_time(self, ctx):
@@ -134,14 +148,114 @@ class MiscCog(commands.Cog):
     async def send_top(self, ctx):
         await self.analyzer.get_user_scores(ctx)
 
+    @slash_command(name='analysis_stats', description="Show message analysis counters")
+    async def send_analysis_stats(self, ctx):
+        embed = Embed(title='Analysis stats')
+        for section, stats in self.analyzer.stats().items():
+            text = '\n'.join(f'{name}: {value}' for name, value in stats.items())
+            embed.add_field(name=section, value=text[:1024] or 'Empty.', inline=False)
+        await ctx.send(embed=embed, ephemeral=True)
+
+    @slash_command(name='db_explain', description="Check that analysis queries are backed by indexes")
+    async def send_db_explain(self, ctx):
+        # explain runs every query to completion, including the full scan of the score rebuild
+        if not ctx.user.guild_permissions.administrator:
+            await ctx.send(embed=Embed(title="Only administrators can do that", color=Colour.red()),
+                           ephemeral=True)
+            return
+        await ctx.response.defer(ephemeral=True)
+        embed = Embed(title='Analysis queries')
+        for name, plan in await self.analyzer.explain_queries(ctx.guild.id, ctx.user.id):
+            index = ', '.join(plan['indexes']) if plan['indexed'] else 'COLLSCAN'
+            embed.add_field(name=name, value=f"{index}\n"
+                                             f"docs examined: {plan['docs_examined']}\n"
+                                             f"keys examined: {plan['keys_examined']}\n"
+                                             f"returned: {plan['returned']}")
+        await ctx.send(embed=embed, ephemeral=True)
+
+    @slash_command(name='words', description="Show the most used words of the server or of a user")
+    async def send_words(self, ctx,
+                         user: Member = SlashOption(
+                             description="Show words of this user only",
+                             required=False,
+                             default=None
+                         )):
+        words = await self.analyzer.words.most_common(ctx.guild.id, user.id if user else None)
+        title = f"Most used words of {user.display_name}" if user else "Most used words"
+        if words:
+            answer = "```" + "".join(f"#{idx + 1} {word} - {count}\n" for idx, (word, count) in enumerate(words)) + "```"
+        else:
+            answer = "Empty."
+        await ctx.send(embed=Embed(title=title, description=answer))
+
+    @slash_command(name='words_rebuild', description="Recount most used words from the whole message history")
+    async def rebuild_words(self, ctx):
+        if not ctx.user.guild_permissions.administrator:
+            await ctx.send(embed=Embed(title="Only administrators can do that", color=Colour.red()),
+                           ephemeral=True)
+            return
+        await ctx.response.defer()
+        messages = await self.analyzer.words.rebuild(ctx.guild.id, self.analyzer.messages_collection)
+        await ctx.send(embed=Embed(title=f"Words recounted from {messages} messages", color=Colour.green()))
+
+    @slash_command(name='import_history', description="Import old messages of every channel to the analysis DB")
+    async def import_history(self, ctx):
+        if not ctx.user.guild_permissions.administrator:
+            await ctx.send(embed=Embed(title="Only administrators can do that", color=Colour.red()),
+                           ephemeral=True)
+            return
+        if self.analyzer.importer.start(self.client.loop, ctx.guild):
+            embed = Embed(title="Import started, use /import_status to watch it", color=Colour.green())
+        else:
+            embed = Embed(title="Import is already running on this server", color=Colour.gold())
+        await ctx.send(embed=embed)
+
+    @slash_command(name='import_status', description="Show progress of the message history import")
+    async def import_status(self, ctx):
+        progress = self.analyzer.importer.jobs.get(ctx.guild.id)
+        if progress is None:
+            embed = Embed(title="Import has not been started", color=Colour.gold())
+        else:
+            embed = Embed(title="History import", description='\n'.join(
+                f'{name}: {value}' for name, value in progress.stats().items()))
+            if progress.error:
+                embed.add_field(name="Error", value=progress.error[:1024])
+        await ctx.send(embed=embed, ephemeral=True)
+
+    @slash_command(name='top_rebuild', description="Rebuild /top scores from the whole message history")
+    async def rebuild_top(self, ctx):
+        if not ctx.user.guild_permissions.administrator:
+            await ctx.send(embed=Embed(title="Only administrators can do that", color=Colour.red()),
+                           ephemeral=True)
+            return
+        await ctx.response.defer()
+        authors = await self.analyzer.rebuild_user_scores(ctx.guild.id)
+        await ctx.send(embed=Embed(title=f"Scores rebuilt for {authors} users", color=Colour.green()))
+
     @slash_command(name='voice')
     async def send_voice_activity(self, ctx):
         await self.analyzer.get_voice_activity(ctx)
 
-    @slash_command(name='activity_date_plot')
-    async def send_activity_date_plot(self, ctx):
-        answer = await self.analyzer.get_activity_date_plot(ctx)
-        await ctx.send(embed=answer, ephemeral=True)
+    @slash_command(name='activity_date_plot', description="Plot messages per channel for the last days")
+    async def send_activity_date_plot(self, ctx,
+                                      days: int = SlashOption(
+                                          description="Amount of days to show (default = 14)",
+                                          required=False,
+                                          default=14,
+                                          min_value=1,
+                                          max_value=365
+                                      ),
+                                      user: Member = SlashOption(
+                                          description="Whose activity to show (default = you)",
+                                          required=False,
+                                          default=None
+                                      )):
+        await ctx.response.defer(ephemeral=True)
+        image = await self.analyzer.get_activity_date_plot(ctx.guild, user or ctx.user, days)
+        if image is None:
+            await ctx.send(embed=Embed(title="No messages in this period", color=Colour.gold()), ephemeral=True)
+            return
+        await ctx.send(file=File(BytesIO(image), filename='activity.png'), ephemeral=True)
 
 
 def setup(bot):
@@ -13,11 +13,13 @@ from config import *
 from collections import deque
 from cryptography.fernet import Fernet
 from modules import wavelink
+from modules.message_registry import open_registry
+from modules.state_store import open_store
 from modules.wavelink import Node, Track
 from modules.wavelink.ext import spotify
 from modules.wavelink.utils import MISSING
 from nextcord import (ButtonStyle, ChannelType, Client, Embed, Interaction, File,
-                      SelectOption, SlashOption, errors, slash_command)
+                      Object, SelectOption, SlashOption, errors, slash_command)
 from nextcord.abc import GuildChannel
 from nextcord.channel import VoiceChannel
 from nextcord.colour import Colour
@@ -244,6 +246,7 @@ async def player_terminate(player, players, history=False):
         await player.lyrics_message.delete()
     with contextlib.suppress(Exception):
         await player.message.delete()
+    forget_player_message(player)
     if history:
         with contextlib.suppress(Exception):
             await player.ctx.send(embed=build_history_embed(player, "Songs played during the session:"))
@@ -251,12 +254,22 @@ async def player_terminate(player, players, history=False):
         players.pop(player.guild.id)
 
 
+def reaction_registry():
+    return open_registry(open_store(STATE_DB_PATH), REACTION_REGISTRY_SIZE)
+
+
+def forget_player_message(player):
+    if player.message is not None:
+        reaction_registry().pop(player.message.id)
+
+
 async def player_message(player: ExtPlayer, bot):
     ctx = player.ctx
     view = PlayerView(player)
     msg = await ctx.send(embed=player_embed(player),
                          view=view)
     player.message = msg
+    reaction_registry().add(msg.id, 'music_player')
     bot.loop.create_task(message_auto_update(player, bot))
 
 
@@ -264,6 +277,7 @@ async def respawn_player_body(player, ctx, bot):
     player.ctx = ctx.channel
     with contextlib.suppress(errors.NotFound, AttributeError, HTTPError):
         await player.message.delete()
+    forget_player_message(player)
     player.message = None
     await player_message(player, bot)
     if player.lyrics_message is not None:
@@ -285,6 +299,7 @@ async def message_auto_update(player, bot):
                 )
                 bad_req = 0
             except errors.NotFound:
+                forget_player_message(player)
                 player.message = None
                 return
             except errors.HTTPException:
@@ -728,6 +743,7 @@ class MusicPlayerCog(commands.Cog, name="Music player"):
         self.bot = bot
         self.bot.loop.create_task(self.connect_nodes())
         self.players = {}
+        self.registry = reaction_registry()
 
     async def connect_nodes(self):
         await self.bot.wait_until_ready()
@@ -921,6 +937,7 @@ class MusicPlayerCog(commands.Cog, name="Music player"):
             embed.set_author(name='Dump ' + name + 'saved',
                              icon_url="https://cdn.discordapp.com/emojis/884559976016805888.webp")
             message = await ctx.send(embed=embed, file=File(data, "dump"))
+            self.registry.add(message.id, 'music_dump')
             await message.add_reaction('💾')
         except:
             embed = Embed(description='Something went wrong...',
@@ -1160,16 +1177,21 @@ class MusicPlayerCog(commands.Cog, name="Music player"):
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
+        entry = self.registry.get(payload.message_id)
+        if entry is None or entry[0] not in ('music_dump', 'music_player'):
+            return
         server_id = payload.guild_id
         channel = self.bot.get_channel(payload.channel_id)
-        try:
-            message = await channel.fetch_message(payload.message_id)
-        except Exception:
-            return
+        message = channel.get_partial_message(payload.message_id)
 
-        user = self.bot.get_user(payload.user_id)
-        if payload.user_id != self.bot.user.id and len(message.reactions) > 0 and \
-                message.reactions[0].emoji == '💾':
+        user = Object(id=payload.user_id)
+        if entry[0] == 'music_dump':
+            if payload.user_id == self.bot.user.id:
+                return
+            try:
+                message = await message.fetch()
+            except Exception:
+                return
             await message.remove_reaction(payload.emoji, user)
             res = await self.load(message, payload.member)
             if res:
@@ -1180,10 +1202,10 @@ class MusicPlayerCog(commands.Cog, name="Music player"):
 
         if server_id not in self.players or \
                 (self.players[server_id].message is not None and self.players[server_id].message.id != message.id):
+            # a player message left over from an earlier session
             with contextlib.suppress(Exception):
-                text = message.embeds[0].description
-                if 'Length' in text and 'Volume' in text and 'Timeline' in text:
-                    await message.delete()
+                await message.delete()
+            self.registry.pop(payload.message_id)
             return
 
         if payload.user_id != self.bot.user.id:
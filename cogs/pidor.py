@@ -1,9 +1,9 @@
 import asyncio
-import contextlib
-import json
 import random
 
 import modules.date as date
+from config import STATE_DB_PATH
+from modules.state_store import open_store
 from nextcord import Embed, slash_command
 from nextcord.colour import Colour
 from nextcord.ext import commands
@@ -23,20 +23,19 @@ class PidorCog(commands.Cog, name="Pidor"):
         self.bot = bot
         self.pidor_channels = {}
         self.pidor_stats = {}
+        self.state = open_store(STATE_DB_PATH)
         self.load()
 
     def save(self):
-        with open('json/pidor_channels.json', 'w') as file:
-            file.write(json.dumps(self.pidor_channels))
-        with open('json/pidor_stats.json', 'w') as file:
-            file.write(json.dumps(self.pidor_stats))
+        self.state.update('pidor_channels', self.pidor_channels)
+        self.state.update('pidor_stats', self.pidor_stats)
 
     def load(self):
-        with contextlib.suppress(json.JSONDecodeError, TypeError, FileNotFoundError):
-            with open('json/pidor_channels.json', 'r') as file:
-                self.pidor_channels = json.load(file)
-            with open('json/pidor_stats.json', 'r') as file:
-                self.pidor_stats = json.load(file)
+        self.pidor_channels = self.state.load('pidor_channels', 'json/pidor_channels.json')
+        self.pidor_stats = self.state.load('pidor_stats', 'json/pidor_stats.json')
+
+    def cog_unload(self):
+        self.state.commit()
 
     @slash_command(name='pidor')
     async def roll(self, ctx):
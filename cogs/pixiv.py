@@ -1,37 +1,127 @@
 import asyncio
 import contextlib
-import json
 import os
 import random
 import time
 from io import BytesIO
 
+import aiohttp
 import emoji
 import modules.date as date
 import requests
 from collections import deque
-from config import PIXIV_SHOW_EMBED_ILLUST, PIXIV_HISTORY_SIZE, SAFETY, USE_SELENIUM
+from config import (PIXIV_AUTO_CONCURRENCY, PIXIV_CACHE_DIR, PIXIV_CACHE_SIZE,
+                    PIXIV_CONNECTIONS, PIXIV_DOWNLOAD_BURST,
+                    PIXIV_DOWNLOAD_CONCURRENCY, PIXIV_DOWNLOAD_RATE,
+                    PIXIV_DOWNLOAD_RETRIES, PIXIV_FIND_MAX_PAGES,
+                    PIXIV_FIND_PREFETCH, PIXIV_FIND_TIME_BUDGET,
+                    PIXIV_HISTORY_DIR, PIXIV_HISTORY_ERROR_RATE,
+                    PIXIV_HISTORY_PERSIST_INTERVAL, PIXIV_HISTORY_SIZE,
+                    PIXIV_HTTP_TIMEOUT, PIXIV_LOGIN_CONCURRENCY,
+                    PIXIV_METADATA_CACHE, PIXIV_NETWORK_RETRIES,
+                    PIXIV_PREFETCH_IMAGES, PIXIV_PREFETCH_LEAD,
+                    PIXIV_PREFETCH_LOW_WATER, PIXIV_PREFETCH_PAGES,
+                    PIXIV_PREFETCH_TTL, PIXIV_REFRESH_JITTER,
+                    PIXIV_REFRESH_MARGIN, PIXIV_RESIZE_FORMAT,
+                    PIXIV_RESIZE_MIN_QUALITY, PIXIV_RESIZE_WORKERS,
+                    PIXIV_SEND_CONCURRENCY, PIXIV_SHOW_EMBED_ILLUST,
+                    REACTION_REGISTRY_SIZE, SAFETY, STATE_DB_PATH,
+                    USE_SELENIUM)
+from modules.disk_cache import DiskCache
+from modules.image_resize import ImageShrinker
+from modules.message_registry import open_registry
 from modules.pixiv_auth import refresh_token, selenium_login
-from nextcord import (Embed, File, Interaction, SlashOption, TextInputStyle,
+from modules.pixiv_downloads import DownloadPool, TooManyRequests
+from modules.pixiv_search import run_search, search_pages
+from modules.recommendations import RecommendationPrefetcher
+from modules.repost_history import RepostHistoryStore
+from modules.scheduler import Scheduler
+from modules.state_store import open_store
+from modules.ttl_cache import CoalescingCache
+from modules.wavelink.backoff import Backoff
+from nextcord import (Embed, File, Interaction, Object, SlashOption, TextInputStyle,
                       slash_command, ui)
 from nextcord.colour import Colour
 from nextcord.ext import commands
-from PIL import Image
-from pixivpy_async import AppPixivAPI
+from pixivpy_async import AppPixivAPI, PixivClient
+from pixivpy_async.net import ClientManager
+
+
+def successful(response):
+    return 'error' not in response
 
 
 class BetterAppPixivAPI(AppPixivAPI):
-    def __init__(self, **requests_kwargs):
+    def __init__(self, refresh_token=None, **requests_kwargs):
         super(AppPixivAPI, self).__init__(**requests_kwargs)
+        self.refresh_token = refresh_token
+        self.login_lock = asyncio.Lock()
+        # endpoint -> cache of its responses, see PIXIV_METADATA_CACHE
+        self.metadata = {name: CoalescingCache(size, ttl, cacheable=successful)
+                         for name, (size, ttl) in PIXIV_METADATA_CACHE.items()}
+
+    async def ensure_login(self):
+        async with self.login_lock:
+            if self.access_token is None:
+                start = time.monotonic()
+                await self.login(refresh_token=self.refresh_token)
+                print(f'pixiv login with token {self.refresh_token[:6]}... took {time.monotonic() - start:.2f}s')
+
+    async def requests_(self, method, url, headers=None, params=None, data=None, auth=True):
+        # tokens are logged in on their first request
+        if auth and self.access_token is None and self.refresh_token is not None:
+            await self.ensure_login()
+        return await super().requests_(method, url, headers=headers, params=params, data=data, auth=auth)
+
+    async def illust_detail(self, illust_id, req_auth=True):
+        return await self.metadata['illust_detail'].get(
+            str(illust_id), super().illust_detail, illust_id, req_auth=req_auth)
+
+    async def illust_related(self, illust_id, filter='for_ios', seed_illust_ids=None, offset=None, req_auth=True):
+        return await self.metadata['illust_related'].get(
+            (str(illust_id), filter, offset), super().illust_related, illust_id, filter=filter,
+            seed_illust_ids=seed_illust_ids, offset=offset, req_auth=req_auth)
+
+    async def illust_bookmark_add(self, illust_id, restrict='public', tags=None, req_auth=True):
+        # cached details would keep the old is_bookmarked
+        self.metadata['illust_detail'].pop(str(illust_id))
+        return await super().illust_bookmark_add(illust_id, restrict=restrict, tags=tags, req_auth=req_auth)
+
+    async def illust_bookmark_delete(self, illust_id=None, req_auth=True):
+        self.metadata['illust_detail'].pop(str(illust_id))
+        return await super().illust_bookmark_delete(illust_id, req_auth=req_auth)
 
     async def download(self, url, prefix='', path=os.path.curdir, fname=None, auto_ext=True,
                        name=None, replace=False, referer='https://app-api.pixiv.net/'):
-        stream = await self.down(url, referer, _request_content_type=False)
-        response = await stream.__anext__()
-        await stream.aclose()
-        return Image.open(BytesIO(response))
+        # transient network errors are retried here, 429 responses by the DownloadPool
+        for attempt in range(PIXIV_NETWORK_RETRIES + 1):
+            try:
+                return await self.fetch_content(url, referer)
+            except aiohttp.ClientResponseError as e:
+                if e.status < 500 or attempt == PIXIV_NETWORK_RETRIES:
+                    raise
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == PIXIV_NETWORK_RETRIES:
+                    raise
+                error = e
+            print(f'download of {url} failed ({error!r}), retry {attempt + 1} of {PIXIV_NETWORK_RETRIES}')
+            await asyncio.sleep(random.uniform(1, 3))
+
+    async def fetch_content(self, url, referer):
+        async with ClientManager(self.session, **self.conn_opt) as session:
+            async with session.get(url, headers={'Referer': referer}, **self.requests_kwargs) as response:
+                if response.status == 429:
+                    retry_after = response.headers.get('Retry-After')
+                    raise TooManyRequests(float(retry_after) if retry_after and retry_after.isdigit() else None)
+                response.raise_for_status()
+                return await response.read()
 
     async def search_autocomplete(self, word, req_auth=True):
+        return await self.metadata['search_autocomplete'].get(
+            word.lower(), self.fetch_autocomplete, word, req_auth=req_auth)
+
+    async def fetch_autocomplete(self, word, req_auth=True):
         hosts = 'https://app-api.pixiv.net'
         method = 'GET'
         url = f'{hosts}/v2/search/autocomplete'
@@ -79,14 +169,13 @@ class LoginModal(ui.Modal):
                     color=Colour.red()),
                     delete_after=10.0)
                 return
-            a = BetterAppPixivAPI()
-            await a.login(refresh_token=token)
+            await self.pixiv.api_for(token).ensure_login()
             server = str(self.ctx.guild.id)
-            self.pixiv.api[token] = a
             self.pixiv.tokens[server] = {"value": token, "time": str(0)}
             embed = Embed(
                 title="Successfully logged in :)", color=Colour.green())
             self.pixiv.save(tokens=True)
+            self.pixiv.schedule_refresh(token)
         except Exception:
             embed = Embed(
                 title="Can't log in with given token :(", color=Colour.red())
@@ -118,13 +207,12 @@ class TokenModal(ui.Modal):
 
     async def auth(self, token):
         try:
-            a = BetterAppPixivAPI()
-            await a.login(refresh_token=token)
+            await self.pixiv.api_for(token).ensure_login()
             server = str(self.ctx.guild.id)
-            self.pixiv.api[token] = a
             self.pixiv.tokens[server] = {"value": token, "time": str(0)}
             embed = Embed(title="Successfully logged in :)", color=Colour.green())
             self.pixiv.save(tokens=True)
+            self.pixiv.schedule_refresh(token)
         except Exception:
             embed = Embed(title="Can't login with given token :(", color=Colour.red())
         await self.ctx.send(embed=embed, delete_after=10.0)
@@ -159,6 +247,85 @@ async def send(illust, channel, file, filename, color, show_title):
         message = await channel.send(file=file)
     if illust.is_bookmarked:
         await message.add_reaction(emoji.emojize(':red_heart:'))
+    return message
+
+
+class OrderedSender:
+    """Posts illusts in the order they were added.
+
+    Up to ``concurrency`` files are downloaded at once. With ``batch``
+    consecutive files are grouped into messages of up to 10 attachments
+    that fit into the guild upload limit. Failed downloads and sends are
+    counted in ``failed``, which ``join`` returns.
+    """
+
+    def __init__(self, pixiv, api, channel, concurrency, show_title=False, color=None, batch=False):
+        self.pixiv = pixiv
+        self.api = api
+        self.channel = channel
+        self.show_title = show_title
+        self.color = color
+        self.batch = batch
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queue = deque()
+        self.poster = None
+        self.failed = 0
+
+    async def download(self, illust, url, num):
+        async with self.semaphore:
+            return await self.pixiv.get_file(self.api, url, self.channel, illust, num)
+
+    def add(self, illust, url, num=None):
+        self.queue.append((illust, asyncio.ensure_future(self.download(illust, url, num))))
+        if self.poster is None or self.poster.done():
+            self.poster = asyncio.ensure_future(self.post())
+
+    async def next_file(self):
+        """Wait for the first queued download without removing it; failed ones are skipped."""
+        while self.queue:
+            illust, download = self.queue[0]
+            try:
+                return illust, await download
+            except Exception as e:
+                self.queue.popleft()
+                self.failed += 1
+                print(f"pixiv download of {illust.id} failed: {e!r}")
+        return None, None
+
+    async def post(self):
+        while self.queue:
+            illust, item = await self.next_file()
+            if item is None:
+                break
+            self.queue.popleft()
+            file, filename, size = item
+            try:
+                if not self.batch:
+                    message = await send(illust, self.channel, file, filename, self.color, self.show_title)
+                    self.pixiv.registry.add(message.id, 'pixiv', {'illust': illust.id, 'locked': False})
+                    continue
+                files = [file]
+                while len(files) < 10:
+                    next_illust, next_item = await self.next_file()
+                    if next_item is None or next_illust.id != illust.id or \
+                            size + next_item[2] > self.channel.guild.filesize_limit:
+                        break
+                    self.queue.popleft()
+                    files.append(next_item[0])
+                    size += next_item[2]
+                message = await self.channel.send(files=files)
+                self.pixiv.registry.add(message.id, 'pixiv', {'illust': illust.id, 'locked': False})
+                if illust.is_bookmarked:
+                    await message.add_reaction(emoji.emojize(':red_heart:'))
+            except Exception as e:
+                self.failed += 1
+                print(f"sending pixiv illust {illust.id} failed: {e!r}")
+
+    async def join(self):
+        """Wait until everything added is posted; returns the number of failures."""
+        if self.poster is not None:
+            await self.poster
+        return self.failed
 
 
 class PixivCog(commands.Cog, name="Pixiv"):
@@ -216,67 +383,118 @@ class PixivCog(commands.Cog, name="Pixiv"):
         self.last_type = {}
         self.token_expiration_time = None
         self.spoilers = {}
-        self.fetched = {}
-        self.queues = asyncio.Queue(0)
-        self.queues.put_nowait(0)
-        self.history = {}
-        self.bot.loop.create_task(self.load())
-        self.delay = 1.5
+        self.searches = set()
+        self.downloads = DownloadPool(PIXIV_DOWNLOAD_RATE, PIXIV_DOWNLOAD_BURST,
+                                      PIXIV_DOWNLOAD_CONCURRENCY, PIXIV_DOWNLOAD_RETRIES)
+        self.cache = DiskCache(PIXIV_CACHE_DIR, PIXIV_CACHE_SIZE)
+        self.shrinker = ImageShrinker(PIXIV_RESIZE_WORKERS, PIXIV_RESIZE_FORMAT, PIXIV_RESIZE_MIN_QUALITY)
+        self.recommendations = RecommendationPrefetcher(self.fetch_recommended, PIXIV_PREFETCH_PAGES,
+                                                        PIXIV_PREFETCH_LOW_WATER, PIXIV_PREFETCH_TTL)
+        self.history = RepostHistoryStore(PIXIV_HISTORY_DIR, PIXIV_HISTORY_SIZE, PIXIV_HISTORY_ERROR_RATE)
+        self.scheduler = Scheduler(self.auto_draw, PIXIV_AUTO_CONCURRENCY)
+        # auto pixiv channel -> time its next recommendation page is prefetched
+        self.prefetcher = Scheduler(self.prefetch_auto_page, 2)
+        # refresh token -> time of its next refresh
+        self.refresher = Scheduler(self.refresh_pixiv_token, 2)
+        self.auth_session = None
+        self.backoffs = {}
+        self.tasks = []
+        self.state = open_store(STATE_DB_PATH)
+        self.registry = open_registry(self.state, REACTION_REGISTRY_SIZE)
+        self.loading = self.bot.loop.create_task(self.load())
+
+    def cog_unload(self):
+        for task in [*self.searches, *self.tasks, *self.scheduler.running, *self.prefetcher.running,
+                     *self.refresher.running]:
+            task.cancel()
+        self.shrinker.close()
+        self.state.commit()
+        self.history.close()
+        self.recommendations.close()
+        for api in self.api.values():
+            self.bot.loop.create_task(api.session.close())
+        if self.auth_session is not None:
+            self.bot.loop.create_task(self.auth_session.close())
 
     def save(self, channels=False, timers=False, tokens=False):
         if channels:
-            with open('json/auto_pixiv_channels.json', 'w') as file:
-                file.write(json.dumps(self.channels))
+            self.state.update('pixiv_channels', self.channels)
         if timers:
-            with open('json/auto_pixiv_timers.json', 'w') as file:
-                file.write(json.dumps(self.timers))
+            self.state.update('pixiv_timers', self.timers)
         if tokens:
-            with open('json/pixiv_tokens.json', 'w') as file:
-                file.write(json.dumps(self.tokens))
+            self.state.update('pixiv_tokens', self.tokens)
 
     async def load(self):
+        self.channels = self.state.load('pixiv_channels', 'json/auto_pixiv_channels.json')
+        self.timers = self.state.load('pixiv_timers', 'json/auto_pixiv_timers.json')
+        self.tokens = self.state.load('pixiv_tokens', 'json/pixiv_tokens.json')
+        for item in self.tokens.values():
+            self.api_for(item["value"])
+        self.bot.loop.create_task(self.login_all())
+
+    def api_for(self, token):
+        """API client of a token, shared by every guild using it, with its own connection pool."""
+        if token not in self.api:
+            session = PixivClient(limit=PIXIV_CONNECTIONS, timeout=PIXIV_HTTP_TIMEOUT).start()
+            self.api[token] = BetterAppPixivAPI(refresh_token=token, client=session)
+        return self.api[token]
+
+    async def login_all(self):
+        semaphore = asyncio.Semaphore(PIXIV_LOGIN_CONCURRENCY)
+
+        async def login(api):
+            async with semaphore:
+                await api.ensure_login()
+
+        start = time.monotonic()
+        apis = list(self.api.values())
+        results = await asyncio.gather(*(login(api) for api in apis), return_exceptions=True)
+        for api, result in zip(apis, results):
+            if isinstance(result, Exception):
+                print(f'pixiv login with token {api.refresh_token[:6]}... failed: {result!r}')
+        print(f'{len(apis)} pixiv tokens logged in {time.monotonic() - start:.2f}s')
+
+    async def fetch_recommended(self, guild_id, next_url):
+        api = self.get_api(guild_id)
+        if next_url:
+            query = await api.illust_recommended(**await api.parse_qs(next_url))
+        else:
+            query = await api.illust_recommended()
+        # posted illusts would be skipped by show_page anyway
+        query.illusts = [illust for illust in query.illusts or []
+                         if not self.history.contains(guild_id, illust.id)]
+        if PIXIV_PREFETCH_IMAGES:
+            for illust in query.illusts:
+                self.bot.loop.create_task(self.prefetch_image(api, illust.image_urls.large))
+        return query
+
+    async def prefetch_image(self, api, url):
         with contextlib.suppress(Exception):
-            with open('json/auto_pixiv_channels.json', 'r') as file:
-                self.channels = json.load(file)
-            with open('json/auto_pixiv_timers.json', 'r') as file:
-                self.timers = json.load(file)
-            with open('json/pixiv_tokens.json', 'r') as file:
-                self.tokens = json.load(file)
-            for guild, item in self.tokens.items():
-                token = item["value"]
-                self.api[token] = BetterAppPixivAPI()
-                await self.api[token].login(refresh_token=token)
+            await self.waited_download(api, url)
 
     async def waited_download(self, api, url):
-        req_time = await self.queues.get()
-        new_time = max(req_time + self.delay, time.time() + self.delay)
-        await self.queues.put(new_time)
-        await asyncio.sleep(req_time - time.time())
-        return await api.download(url)
+        content = await self.cache.get(url)
+        if content is None:
+            content = await self.downloads.download(api.refresh_token, api.download, url)
+            await self.cache.set(url, content)
+        return content
 
     async def get_file(self, api, url, channel, illust, num):
-        img = await self.waited_download(api, url)
+        content = await self.waited_download(api, url)
         img_type = url.split('.')[-1]
+        # only images above the upload limit are decoded, the rest are sent as downloaded
+        if len(content) > channel.guild.filesize_limit:
+            content, img_type = await self.shrinker.shrink(self.bot.loop, content, channel.guild.filesize_limit)
         filename = f'{str(illust.id)}.{img_type}'
         if num is not None:
             filename = f'{num}_{filename}'
         if channel.guild.id in self.spoilers and self.spoilers[channel.guild.id] and illust.sanity_level >= 6:
             filename = f'SPOILER_{filename}'
-        with BytesIO() as image_binary:
-            img.save(image_binary, img.format)
-            image_binary.seek(0)
-            file = File(fp=image_binary, filename=filename)
         if SAFETY and illust.sanity_level > 4 and not channel.nsfw:
             response = requests.get(
                 'https://img.youtube.com/vi/nter2axWgoA/mqdefault.jpg')
-            with BytesIO(response.content) as image_binary:
-                file = File(fp=image_binary, filename=filename)
-        return file, filename
-
-    async def send_illust(self, api, illust, url, channel, num=None,
-                          show_title=False, color=None):
-        file, filename = await self.get_file(api, url, channel, illust, num)
-        await send(illust, channel, file, filename, color, show_title)
+            content = response.content
+        return File(fp=BytesIO(content), filename=filename), filename, len(content)
 
     async def show_illust(self, api, illust_id, channel):
         try:
@@ -285,30 +503,20 @@ class PixivCog(commands.Cog, name="Pixiv"):
                                            color=Colour.green()), delete_after=5.0)
             if isinstance(channel, Interaction):
                 channel = channel.channel
+            sender = OrderedSender(self, api, channel, PIXIV_SEND_CONCURRENCY, batch=True)
             if len(illust.meta_single_page) > 0:
-                url = illust.meta_single_page.original_image_url
-                await self.send_illust(api, illust, url, channel)
+                sender.add(illust, illust.meta_single_page.original_image_url)
             for idx, item in enumerate(illust.meta_pages):
-                url = item.image_urls.original
-                await self.send_illust(api, illust, url, channel, idx)
+                sender.add(illust, item.image_urls.original, idx)
+            if await sender.join():
+                raise RuntimeError(f"{sender.failed} pages of {illust_id} were not sent")
             return True
         except Exception:
             await channel.send(embed=Embed(title='Fail', color=Colour.red()), delete_after=5.0)
             return None
 
     def history_repeating(self, illust, channel):
-        if channel.guild.id not in self.history:
-            self.history[channel.guild.id] = [set(), deque()]
-        elements = self.history[channel.guild.id][0]
-        queue = self.history[channel.guild.id][1]
-        if illust.id in elements:
-            return True
-        elements.add(illust.id)
-        queue.append(illust.id)
-        if len(queue) > PIXIV_HISTORY_SIZE:
-            idx = queue.popleft()
-            elements.remove(idx)
-        return False
+        return self.history.seen(channel.guild.id, illust.id)
 
     async def show_page(self, api, query, channel, limit=30, use_history=True,
                         minimum_views=None, minimum_rate=None, min_sanity=0, max_sanity=6, dry_run=False):
@@ -317,14 +525,13 @@ class PixivCog(commands.Cog, name="Pixiv"):
         if channel.nsfw:
             min_sanity = 5
         shown = 0
-        color = Colour.random()
+        sender = OrderedSender(self, api, channel, PIXIV_SEND_CONCURRENCY, show_title=True, color=Colour.random())
         for illust in query.illusts:
             if not good_image(illust, minimum_views, minimum_rate, min_sanity, max_sanity) or \
                use_history and not dry_run and self.history_repeating(illust, channel):
                 continue
             if not dry_run:
-                self.bot.loop.create_task(self.send_illust(api, illust, illust.image_urls.large,
-                                                           channel, show_title=True, color=color))
+                sender.add(illust, illust.image_urls.large)
 
             shown += 1
             if shown == limit:
@@ -353,6 +560,8 @@ class PixivCog(commands.Cog, name="Pixiv"):
         server = str(ctx.guild.id)
         if server in self.tokens:
             self.tokens.pop(server)
+            self.recommendations.drop(ctx.guild.id)
+            self.save(tokens=True)
             embed = Embed(title="Successfully logged out",
                           color=Colour.green())
         else:
@@ -382,6 +591,22 @@ class PixivCog(commands.Cog, name="Pixiv"):
                 title="Either you are not connected or there is a problem with the API", color=Colour.red())
         await ctx.send(embed=embed, delete_after=10.0)
 
+    @slash_command(name="pixiv_stats", description="Show pixiv download statistics")
+    async def pixiv_stats(self, ctx):
+        embed = Embed(title="Pixiv stats", color=Colour.green())
+        sections = {"Downloads": self.downloads.stats(), "Cache": self.cache.stats(),
+                    "Resize": self.shrinker.stats(), "Repost history": self.history.stats(),
+                    "Recommendations": self.recommendations.stats(),
+                    "Reaction messages": self.registry.stats()}
+        api = self.get_api(ctx.guild.id)
+        if api is not None:
+            for name, cache in api.metadata.items():
+                sections[name] = cache.stats()
+        for section, stats in sections.items():
+            text = '\n'.join(f'{name}: {value}' for name, value in stats.items())
+            embed.add_field(name=section, value=text[:1024] or 'Empty.', inline=False)
+        await ctx.send(embed=embed, ephemeral=True)
+
     @slash_command(name="start_auto_pixiv", description="Add channel to the auto Pixiv list")
     async def add_auto_pixiv(self, ctx,
                              refresh_time: int = SlashOption(
@@ -403,6 +628,7 @@ class PixivCog(commands.Cog, name="Pixiv"):
         else:
             self.channels[channel_id] = {
                 "refresh_time": refresh_time * 60, "limit": limit}
+            self.schedule_channel(channel_id)
             embed = Embed(
                 title="Auto Pixiv is now running on this channel", color=Colour.green())
         await ctx.send(embed=embed)
@@ -415,6 +641,8 @@ class PixivCog(commands.Cog, name="Pixiv"):
             self.channels.pop(channel_id)
             if channel_id in self.timers.keys():
                 self.timers.pop(channel_id)
+            self.scheduler.cancel(channel_id)
+            self.prefetcher.cancel(channel_id)
             embed = Embed(title="Channel has been deleted",
                           color=Colour.green())
         else:
@@ -447,11 +675,11 @@ class PixivCog(commands.Cog, name="Pixiv"):
         await ctx.response.defer()
         api = self.get_api(ctx.guild.id)
         if ctx.user.id in self.last_query:
-            next_qs = await api.parse_qs(self.last_query[ctx.user.id].next_url)
             query = None
             if self.last_type[ctx.user.id] == 'recommended':
-                query = await api.illust_recommended(**next_qs)
+                query = await self.recommendations.take(ctx.guild.id)
             elif self.last_type[ctx.user.id] == 'best':
+                next_qs = await api.parse_qs(self.last_query[ctx.user.id].next_url)
                 query = await api.illust_ranking(**next_qs)
             embed = await self.show_page_embed(api, query, self.last_type[ctx.user.id], ctx.channel,
                                                limit, save_query=True, user_id=ctx.user.id)
@@ -470,7 +698,7 @@ class PixivCog(commands.Cog, name="Pixiv"):
         await ctx.response.defer()
         api = self.get_api(ctx.guild.id)
         try:
-            query = await api.illust_recommended()
+            query = await self.recommendations.take(ctx.guild.id)
             embed = await self.show_page_embed(api, query, 'recommended', ctx.channel, limit,
                                                save_query=True, user_id=ctx.user.id)
         except Exception:
@@ -548,45 +776,22 @@ class PixivCog(commands.Cog, name="Pixiv"):
                 title="Authentication required!\nCall /pixiv_login first for more info", color=Colour.red())
         await ctx.send(embed=embed, delete_after=30.0)
 
-    async def recursive_find(self, api, ctx, word, match, limit,
-                             views, rate, max_sanity_level, selected_date,
-                             offset=0, shown=0, rv=None, lvl=0):
-        find_next = False
-        query = None
-        good = 0
-        if shown < limit and lvl < 15:
-            query = await api.search_illust(word, search_target=match,
-                                            end_date=selected_date, offset=offset)
-            alive = True
-            if len(query.illusts) == 0 and selected_date < date.current():
-                selected_date = date.next_year(selected_date)
-                offset = 0
-            else:
-                good, total, alive = await self.show_page(api, query, ctx.channel, limit - shown, use_history=False,
-                                                          minimum_views=views, minimum_rate=rate,
-                                                          max_sanity=max_sanity_level, dry_run=True)
-                self.fetched[rv] += total
-                if alive:
-                    offset += total
-            if alive:
-                find_next = True
-        if find_next:
-            self.bot.loop.create_task(
-                self.recursive_find(api, ctx, word, match, limit,
-                                    views, rate, max_sanity_level, selected_date,
-                                    offset=offset, shown=shown + good, rv=rv, lvl=lvl+1)
-            )
-            self.bot.loop.create_task(
-                self.show_page(api, query, ctx.channel, good,
-                               use_history=False, minimum_views=views,
-                               minimum_rate=rate, max_sanity=max_sanity_level)
-            )
-        else:
-            embed = Embed(title=f"Find with word {word} called",
-                          description=f'{str(self.fetched[rv])} images fetched in total', color=Colour.green())
+    async def find_illusts(self, api, channel, word, match, limit, selected_date, accept):
+        sender = OrderedSender(self, api, channel, PIXIV_SEND_CONCURRENCY, show_title=True, color=Colour.random())
 
-            self.fetched.pop(rv)
-            await ctx.send(embed=embed, delete_after=10.0)
+        async def sink(illust):
+            sender.add(illust, illust.image_urls.large)
+
+        pages = search_pages(api, word, match, selected_date, PIXIV_FIND_MAX_PAGES)
+        search = self.bot.loop.create_task(run_search(pages, accept, sink, limit,
+                                                      PIXIV_FIND_TIME_BUDGET, PIXIV_FIND_PREFETCH))
+        self.searches.add(search)
+        try:
+            stats = await search
+        finally:
+            self.searches.discard(search)
+        await sender.join()
+        return stats
 
     @slash_command(name='find', description='Find illustrations that satisfy the filters from random point of time')
     async def find(self, ctx,
@@ -660,11 +865,14 @@ class PixivCog(commands.Cog, name="Pixiv"):
         selected_date = date.random(period, date.current(), random.random())
         if date.is_valid(from_date):
             selected_date = from_date
-        rv = random.random()
-        self.fetched[rv] = 0
+        min_sanity = 5 if ctx.channel.nsfw else 0
         try:
-            await self.recursive_find(api, ctx, word, match, limit, views, rate,
-                                      max_sanity_level, selected_date, 0, 0, rv, 0)
+            stats = await self.find_illusts(api, ctx.channel, word, match, limit, selected_date,
+                                            lambda illust: good_image(illust, views, rate, min_sanity,
+                                                                      max_sanity_level))
+            embed = Embed(title=f"Find with word {word} called",
+                          description=stats.describe(), color=Colour.green())
+            await ctx.send(embed=embed, delete_after=10.0)
         except Exception:
             embed = Embed(
                 title="Authentication required!\nCall /pixiv_login first for more info", color=Colour.red())
@@ -677,31 +885,24 @@ class PixivCog(commands.Cog, name="Pixiv"):
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
+        entry = self.registry.get(payload.message_id)
+        if entry is None:
+            return
+        kind, data = entry
         api = self.get_api(payload.guild_id)
         channel = self.bot.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-
-        user = self.bot.get_user(payload.user_id)
+        # enough to react, edit or delete without fetching the message
+        message = channel.get_partial_message(payload.message_id)
+        user = Object(id=payload.user_id)
 
         try:
             demojized = emoji.demojize(payload.emoji.name)
         except TypeError:
             demojized = None
         if payload.user_id != self.bot.user.id:
-            if message.attachments is not None and message.author == self.bot.user:
-                illust_id = None
-                lock_info = False
-                if len(message.attachments) == 1:
-                    illust_id = message.attachments[0].filename.split('.')[
-                        0].split('_')[-1]
-                    if not illust_id.isnumeric():
-                        illust_id = None
-                with contextlib.suppress(Exception):
-                    if "Pixiv ID" in message.embeds[0].fields[1].name:
-                        illust_id = message.embeds[0].fields[1].value
-                        lock_info = True
-                if illust_id is None:
-                    return
+            if kind == 'pixiv':
+                illust_id = str(data['illust'])
+                lock_info = data['locked']
                 emojis = {':red_heart:', ':growing_heart:', ':magnifying_glass_tilted_left:', ':seedling:',
                           ':broken_heart:', ':red_question_mark:', ':elephant:', ':face_vomiting:'}
                 if demojized in emojis:
@@ -736,10 +937,11 @@ class PixivCog(commands.Cog, name="Pixiv"):
                         await message.add_reaction(emoji.emojize(':thumbs_down:'))
                 elif demojized == ':face_vomiting:' and not lock_info:
                     await message.delete()
+                    self.registry.pop(payload.message_id)
                 elif demojized == ':broken_heart:':
                     try:
                         await api.illust_bookmark_delete(illust_id)
-                        for r in message.reactions:
+                        for r in (await message.fetch()).reactions:
                             if r.me:
                                 await r.remove(self.bot.user)
                         await message.add_reaction(emoji.emojize(':broken_heart:'))
@@ -777,52 +979,90 @@ class PixivCog(commands.Cog, name="Pixiv"):
             await asyncio.sleep(5)
             await message.remove_reaction(payload.emoji, user)
 
-    async def auto_draw(self):
-        bad_channels = []
-        if self.channels is None:
+    def schedule_channel(self, channel_id):
+        options = self.channels[channel_id]
+        when = self.timers.get(channel_id, 0) + options['refresh_time']
+        self.scheduler.schedule(channel_id, when)
+        # posts are further apart than the prefetch ttl, so the page is fetched just before
+        self.prefetcher.schedule(channel_id, when - PIXIV_PREFETCH_LEAD)
+
+    async def prefetch_auto_page(self, channel_id):
+        channel = self.bot.get_channel(int(channel_id))
+        if channel_id in self.channels and channel is not None and self.get_api(channel.guild.id) is not None:
+            self.recommendations.refill(channel.guild.id, 1)
+
+    async def auto_draw(self, channel_id):
+        options = self.channels.get(channel_id)
+        if options is None:
             return
-        for channel_id, options in self.channels.items():
-            with contextlib.suppress(Exception):
-                channel = self.bot.get_channel(int(channel_id))
-                if channel is None:
-                    bad_channels.append(channel_id)
-                    continue
-                api = self.get_api(channel.guild.id)
-                if api is None:
-                    bad_channels.append(channel_id)
-                    continue
-                refresh_time = options['refresh_time']
-                limit = options['limit']
-                timestamp = time.time()
-                if channel_id not in self.timers.keys() or timestamp - self.timers[channel_id] > refresh_time:
-                    self.timers[str(channel_id)] = timestamp
-                    query = await api.illust_recommended()
-                    await self.show_page(api, query, channel, limit=limit)
-                    self.save(timers=True)
-        for channel_id in bad_channels:
+        channel = self.bot.get_channel(int(channel_id))
+        api = self.get_api(channel.guild.id) if channel is not None else None
+        if api is None:
             self.channels.pop(channel_id)
-        if bad_channels:
-            self.save(channels=True)
-
-    async def auto_refresh_tokens(self):
-        timestamp = time.time()
-        for server_id in self.tokens:
-            if int(self.tokens[server_id]['time']) - timestamp < 1000:
-                token, ttl = refresh_token(self.tokens[server_id]['value'])
-                self.tokens[server_id]['time'] = str(int(timestamp + ttl))
-                await self.api[token].login(refresh_token=token)
-                print('pixiv token updated')
+            self.timers.pop(channel_id, None)
+            self.save(channels=True, timers=True)
+            return
+        self.timers[channel_id] = time.time()
+        self.schedule_channel(channel_id)
+        self.save(timers=True)
+        query = await self.recommendations.take(channel.guild.id, refill=False)
+        await self.show_page(api, query, channel, limit=options['limit'])
 
-    @commands.Cog.listener()
-    async def on_ready(self):
+    def schedule_refresh(self, token):
+        expiry = max(int(item['time']) for item in self.tokens.values() if item['value'] == token)
+        when = expiry - PIXIV_REFRESH_MARGIN - random.uniform(0, PIXIV_REFRESH_JITTER)
+        # tokens saved without expiry time are refreshed soon after start
+        self.refresher.schedule(token, max(when, time.time() + random.uniform(0, PIXIV_REFRESH_JITTER)))
+
+    async def refresh_pixiv_token(self, token):
+        servers = [server for server, item in self.tokens.items() if item['value'] == token]
+        if not servers:
+            return
+        if self.auth_session is None:
+            self.auth_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PIXIV_HTTP_TIMEOUT))
+        try:
+            new_token, access_token, ttl = await refresh_token(self.auth_session, token)
+        except Exception as e:
+            backoff = self.backoffs.setdefault(token, Backoff(base=5, maximum_time=3600, maximum_tries=None))
+            delay = backoff.calculate()
+            print(f'pixiv token {token[:6]}... refresh failed, retry in {delay:.0f}s: {e!r}')
+            self.refresher.schedule(token, time.time() + delay)
+            return
+        self.backoffs.pop(token, None)
+        api = self.api_for(token)
+        api.set_auth(access_token, new_token)
+        if new_token != token:
+            self.api[new_token] = self.api.pop(token)
+            self.refresher.cancel(token)
+        expiry = str(int(time.time() + ttl))
+        for server in servers:
+            self.tokens[server] = {"value": new_token, "time": expiry}
+        self.save(tokens=True)
+        self.schedule_refresh(new_token)
+        print('pixiv token updated')
+
+    async def history_persist_loop(self):
         while True:
-            await asyncio.sleep(30)
-            with contextlib.suppress(Exception):
-                await self.auto_refresh_tokens()
-            with contextlib.suppress(Exception):
-                await self.auto_draw()
-            self.save(channels=True, timers=True)
+            await asyncio.sleep(PIXIV_HISTORY_PERSIST_INTERVAL)
+            try:
+                await self.history.persist()
+            except Exception as e:
+                print(f"can't save repost history: {e!r}")
 
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # on_ready is dispatched again after every reconnect
+        if self.tasks:
+            return
+        self.tasks = [self.bot.loop.create_task(self.scheduler.run()),
+                      self.bot.loop.create_task(self.prefetcher.run()),
+                      self.bot.loop.create_task(self.refresher.run()),
+                      self.bot.loop.create_task(self.history_persist_loop())]
+        await self.loading
+        for channel_id in self.channels:
+            self.schedule_channel(channel_id)
+        for token in {item['value'] for item in self.tokens.values()}:
+            self.schedule_refresh(token)
 
 def setup(bot):
     bot.add_cog(PixivCog(bot))
@@ -2,9 +2,82 @@
 TOKEN = ''
 DB_ADDRESS = '127.0.0.1'
 DB_NAME = 'TabaBotDB'
+DB_MAX_POOL_SIZE = 20
+DB_WORKERS = 4
+SCORES_FLUSH_INTERVAL = 30
+MESSAGES_BATCH_SIZE = 500
+MESSAGES_FLUSH_INTERVAL_MS = 1000
+MESSAGES_BUFFER_SIZE = 10000
+MESSAGES_PUT_TIMEOUT = 0.5
+VOICE_FLUSH_INTERVAL = 60
+USERNAME_CACHE_SIZE = 4096
+USERNAME_CACHE_TTL = 3600
+USERNAME_FETCH_CONCURRENCY = 4
+ACTIVITY_PLOT_WORKERS = 1
+ACTIVITY_PLOT_CACHE_TTL = 300
+WORDS_MIN_LENGTH = 3
+WORDS_TOP_CAPACITY = 100
+WORDS_GUILD_SKETCH_WIDTH = 8192
+WORDS_USER_SKETCH_WIDTH = 1024
+WORDS_SKETCH_DEPTH = 4
+# member word counters kept in memory, the others are read from the DB when shown
+WORDS_MAX_USERS = 2000
+WORDS_PERSIST_INTERVAL = 300
+IMPORT_RATE = 1.0
+IMPORT_BURST = 5
+IMPORT_BATCH_SIZE = 500
+STATE_DB_PATH = 'json/state.db'
+# bot messages that handle reactions, remembered to skip fetching unrelated messages
+REACTION_REGISTRY_SIZE = 10000
 
-PIXIV_HISTORY_SIZE = 25
+# illust ids remembered per guild to avoid reposts, see modules/repost_history.py
+PIXIV_HISTORY_SIZE = 20000
+PIXIV_HISTORY_ERROR_RATE = 0.001
+PIXIV_HISTORY_DIR = 'json/pixiv_history'
+PIXIV_HISTORY_PERSIST_INTERVAL = 300
+# connections and request timeout of every pixiv token's session
+PIXIV_CONNECTIONS = 10
+PIXIV_HTTP_TIMEOUT = 60
+PIXIV_LOGIN_CONCURRENCY = 4
+# tokens are refreshed this many seconds before expiry, minus a random jitter
+PIXIV_REFRESH_MARGIN = 600
+PIXIV_REFRESH_JITTER = 300
 PIXIV_SHOW_EMBED_ILLUST = False
+# downloads per second and burst for every pixiv token
+PIXIV_DOWNLOAD_RATE = 2.0
+PIXIV_DOWNLOAD_BURST = 5
+PIXIV_DOWNLOAD_CONCURRENCY = 8
+PIXIV_DOWNLOAD_RETRIES = 3
+# retries of a download after a connection error, timeout or 5xx response
+PIXIV_NETWORK_RETRIES = 3
+# images above the guild upload limit are re-encoded as JPEG or WEBP
+PIXIV_RESIZE_FORMAT = 'JPEG'
+PIXIV_RESIZE_MIN_QUALITY = 60
+PIXIV_RESIZE_WORKERS = 1
+# /find: search requests, seconds and pages fetched ahead
+PIXIV_FIND_MAX_PAGES = 15
+PIXIV_FIND_TIME_BUDGET = 60
+PIXIV_FIND_PREFETCH = 1
+# images of one page downloaded at once, they are posted in order
+PIXIV_SEND_CONCURRENCY = 4
+# auto pixiv channels posting at the same time
+PIXIV_AUTO_CONCURRENCY = 4
+# recommendation pages kept ready per guild, refilled below the low water mark
+PIXIV_PREFETCH_PAGES = 2
+PIXIV_PREFETCH_LOW_WATER = 1
+PIXIV_PREFETCH_TTL = 1800
+# auto pixiv fetches its page this many seconds before posting instead of after
+PIXIV_PREFETCH_LEAD = 60
+# also download the images of prefetched pages into the cache
+PIXIV_PREFETCH_IMAGES = False
+PIXIV_CACHE_DIR = 'cache/pixiv'
+PIXIV_CACHE_SIZE = 1024 * 2 ** 20
+# pixiv endpoint -> (cached responses per token, seconds to keep them)
+PIXIV_METADATA_CACHE = {
+    'illust_detail': (1024, 600),
+    'illust_related': (256, 600),
+    'search_autocomplete': (512, 24 * 3600)
+}
 USE_SELENIUM = False
 VOLUME_LOCK = False
 SAFETY = False
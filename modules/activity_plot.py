@@ -0,0 +1,70 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+PERIODS = {
+    "hour": ("60min", timedelta(hours=1)),
+    "day": ("1D", timedelta(days=1))
+}
+
+
+def bucket_start(timestamp, period):
+    timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+
+def render_activity_plot(rows, channels, start, end, period, title):
+    """Render messages per bucket and channel as PNG bytes.
+
+    Runs in a worker process, so only plain data is passed in and matplotlib
+    is imported there.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import seaborn as sns
+
+    frequency, _ = PERIODS[period]
+    index = pd.date_range(start, end, freq=frequency)
+    df = pd.DataFrame(rows)
+    table = df.pivot_table(index="bucket", columns="channel_id", values="messages",
+                           aggfunc="sum").reindex(index, fill_value=0).fillna(0)
+    table.columns = [channels.get(channel_id, str(channel_id)) for channel_id in table.columns]
+
+    sns.set_theme(style="darkgrid")
+    fig, ax = plt.subplots(figsize=(10, 4))
+    sns.lineplot(data=table, ax=ax, dashes=False)
+    ax.set_title(title)
+    ax.set_xlabel("")
+    ax.set_ylabel("messages")
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    with BytesIO() as image_binary:
+        fig.savefig(image_binary, format="png")
+        plt.close(fig)
+        return image_binary.getvalue()
+
+
+class ActivityPlotter:
+    """Renders activity plots in a process pool and caches the PNGs."""
+
+    def __init__(self, cache, max_workers=1):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.executor = None
+
+    async def render(self, loop, key, *args):
+        image = self.cache.get(key)
+        if image is None:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.max_workers)
+            image = await loop.run_in_executor(self.executor, render_activity_plot, *args)
+            self.cache.set(key, image)
+        return image
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,81 @@
+from pymongo import ASCENDING, DESCENDING
+
+# collection -> list of (keys, options) every analysis query relies on
+INDEXES = {
+    "messages": [
+        ([("guild_id", ASCENDING), ("is_bot", ASCENDING)], {}),
+        ([("guild_id", ASCENDING), ("author_id", ASCENDING), ("timestamp", ASCENDING)], {}),
+        ([("channel_id", ASCENDING), ("timestamp", ASCENDING)], {}),
+        ([("message_id", ASCENDING)],
+         {"unique": True, "partialFilterExpression": {"message_id": {"$exists": True}}})
+    ],
+    "voice_activity": [
+        ([("guild_id", ASCENDING), ("user_id", ASCENDING)], {}),
+        ([("session_active", ASCENDING)], {})
+    ],
+    "user_scores": [
+        ([("guild_id", ASCENDING), ("author_id", ASCENDING)], {"unique": True}),
+        ([("guild_id", ASCENDING), ("score", DESCENDING)], {})
+    ],
+    "activity_rollups": [
+        ([("guild_id", ASCENDING), ("user_id", ASCENDING), ("period", ASCENDING),
+          ("bucket", ASCENDING), ("channel_id", ASCENDING)], {"unique": True})
+    ],
+    "import_checkpoints": [
+        ([("channel_id", ASCENDING)], {"unique": True})
+    ],
+    "word_stats": [
+        ([("guild_id", ASCENDING), ("user_id", ASCENDING)], {"unique": True})
+    ]
+}
+
+
+def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            db[collection].create_index(keys, **options)
+
+
+def analysis_queries(guild_id, user_id):
+    """Queries issued by AnalysisModule as (name, collection, filter, sort)."""
+    return [
+        ("top", "user_scores", {"guild_id": guild_id}, {"score": DESCENDING}),
+        ("scores upsert", "user_scores", {"guild_id": guild_id, "author_id": user_id}, None),
+        ("scores rebuild", "messages", {"guild_id": guild_id, "is_bot": False}, None),
+        ("activity plot", "activity_rollups", {"guild_id": guild_id, "user_id": user_id, "period": "day"}, None),
+        ("voice", "voice_activity", {"guild_id": guild_id}, None),
+        ("stale sessions", "voice_activity", {"session_active": True}, None)
+    ]
+
+
+def find_values(document, key):
+    if isinstance(document, dict):
+        for name, value in document.items():
+            if name == key:
+                yield value
+            else:
+                yield from find_values(value, key)
+    elif isinstance(document, list):
+        for value in document:
+            yield from find_values(value, key)
+
+
+def explain_query(db, collection, query, sort=None):
+    command = {"find": collection, "filter": query}
+    if sort is not None:
+        command["sort"] = sort
+    plan = db.command({"explain": command, "verbosity": "executionStats"})
+    winning_plan = plan["queryPlanner"]["winningPlan"]
+    stats = plan["executionStats"]
+    return {
+        "indexed": "IXSCAN" in set(find_values(winning_plan, "stage")),
+        "indexes": sorted(set(find_values(winning_plan, "indexName"))),
+        "docs_examined": stats["totalDocsExamined"],
+        "keys_examined": stats["totalKeysExamined"],
+        "returned": stats["nReturned"]
+    }
+
+
+def explain_analysis_queries(db, guild_id, user_id):
+    return [(name, explain_query(db, collection, query, sort))
+            for name, collection, query, sort in analysis_queries(guild_id, user_id)]
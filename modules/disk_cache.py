@@ -0,0 +1,121 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        content = file.read()
+    # modification time keeps the LRU order across restarts
+    os.utime(path)
+    return content
+
+
+def write_file(path, content):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # unique per writer, so concurrent writes of one path never share a file
+    descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(content)
+        os.replace(temporary, path)
+    except BaseException:
+        remove_files([temporary])
+        raise
+
+
+def remove_files(paths):
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+class DiskCache:
+    """Content addressed byte cache in ``directory`` of at most ``max_bytes``.
+
+    Files are named by the sha256 of their key and the least recently used
+    ones are removed when the cache grows over the limit. The index lives
+    in memory and is rebuilt from the directory on start; file reads and
+    writes run in worker threads.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # name -> size, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.scan()
+
+    def scan(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+        remove_files(self.evict())
+
+    def path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    @staticmethod
+    def name(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    async def get(self, key):
+        name = self.name(key)
+        if name in self.entries:
+            self.entries.move_to_end(name)
+            with contextlib.suppress(FileNotFoundError):
+                content = await asyncio.to_thread(read_file, self.path(name))
+                self.hits += 1
+                self.bytes_saved += len(content)
+                return content
+            self.size -= self.entries.pop(name, 0)
+        self.misses += 1
+        return None
+
+    async def set(self, key, content):
+        if len(content) > self.max_bytes:
+            return
+        name = self.name(key)
+        try:
+            await asyncio.to_thread(write_file, self.path(name), content)
+        except OSError as e:
+            # the content was downloaded anyway, a cache failure must not fail the caller
+            print(f"can't cache {key}: {e!r}")
+            return
+        self.size += len(content) - self.entries.pop(name, 0)
+        self.entries[name] = len(content)
+        removed = self.evict()
+        if removed:
+            await asyncio.to_thread(remove_files, removed)
+
+    def evict(self):
+        removed = []
+        while self.size > self.max_bytes and self.entries:
+            name, size = self.entries.popitem(last=False)
+            self.size -= size
+            removed.append(self.path(name))
+        return removed
+
+    def stats(self):
+        return {
+            "files": len(self.entries),
+            "size": f"{self.size / 2 ** 20:.1f} / {self.max_bytes / 2 ** 20:.0f} MiB",
+            "hits": self.hits,
+            "misses": self.misses,
+            "saved": f"{self.bytes_saved / 2 ** 20:.1f} MiB"
+        }
@@ -0,0 +1,133 @@
+import time
+
+from nextcord import Object
+from nextcord.utils import time_snowflake, utcnow
+from modules.write_buffer import DUPLICATE_KEY
+from pymongo.errors import BulkWriteError
+
+
+class ImportProgress:
+    def __init__(self, channels):
+        self.channels = channels
+        self.channels_done = 0
+        self.scanned = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.error = None
+
+    def rate(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.scanned / elapsed if elapsed > 0 else 0
+
+    def stats(self):
+        return {
+            "status": "failed" if self.error else "running" if self.finished is None else "done",
+            "channels": f"{self.channels_done}/{self.channels}",
+            "scanned": self.scanned,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "throughput": f"{self.rate():.1f} messages/s"
+        }
+
+
+class HistoryImporter:
+    """Backfills the messages collection from channel.history().
+
+    Channels are read oldest first, one page of 100 messages per token of
+    the shared rate limit bucket, and written in batches of ``batch_size``.
+    The id of the last written message is checkpointed per channel in
+    import_checkpoints, so a restarted import continues where it stopped.
+    Messages already stored (by message_id, or by author and timestamp for
+    documents saved before message ids were recorded) are skipped and
+    ``on_insert`` is called only for new documents. ``flush_live`` writes
+    the live message buffer before every channel, so a message counted on
+    arrival is stored before the importer sees it and not counted twice.
+    """
+
+    def __init__(self, messages, checkpoints, document, on_insert, flush_live, bucket, batch_size=500):
+        self.messages = messages
+        self.checkpoints = checkpoints
+        self.document = document
+        self.on_insert = on_insert
+        self.flush_live = flush_live
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.jobs = {}
+        self.tasks = {}
+
+    def start(self, loop, guild):
+        if guild.id in self.tasks and not self.tasks[guild.id].done():
+            return False
+        self.tasks[guild.id] = loop.create_task(self.import_guild(guild))
+        return True
+
+    async def import_guild(self, guild):
+        # newer messages are saved by on_message
+        until = Object(id=time_snowflake(utcnow()))
+        channels = [channel for channel in guild.text_channels
+                    if channel.permissions_for(guild.me).read_message_history]
+        progress = self.jobs[guild.id] = ImportProgress(len(channels))
+        try:
+            for channel in channels:
+                await self.import_channel(channel, until, progress)
+                progress.channels_done += 1
+        except Exception as e:
+            progress.error = str(e)
+        progress.finished = time.monotonic()
+        print(f"history import of {guild.id}: {progress.stats()}")
+
+    async def import_channel(self, channel, until, progress):
+        await self.flush_live()
+        checkpoint = await self.checkpoints.find_one({"channel_id": channel.id})
+        after = Object(id=checkpoint["last_message_id"]) if checkpoint else None
+        batch = []
+        while True:
+            await self.bucket.acquire()
+            page = await channel.history(limit=100, after=after, before=until, oldest_first=True).flatten()
+            if not page:
+                break
+            progress.scanned += len(page)
+            after = page[-1]
+            batch.extend(self.document(message) for message in page
+                         if message.author.id != channel.guild.me.id)
+            if len(batch) >= self.batch_size:
+                await self.write(channel, batch, after.id, progress)
+                batch = []
+            if len(page) < 100:
+                break
+        if batch:
+            await self.write(channel, batch, after.id, progress)
+
+    async def drop_legacy(self, channel_id, batch):
+        legacy = await self.messages.find(
+            {"channel_id": channel_id, "message_id": {"$exists": False},
+             "timestamp": {"$gte": batch[0]["timestamp"], "$lte": batch[-1]["timestamp"]}},
+            ["author_id", "timestamp"])
+        stored = {(item["author_id"], item["timestamp"]) for item in legacy}
+        return [item for item in batch
+                if (item["author_id"], item["timestamp"].replace(tzinfo=None)) not in stored]
+
+    async def write(self, channel, batch, last_message_id, progress):
+        size = len(batch)
+        batch = await self.drop_legacy(channel.id, batch)
+        inserted = batch
+        if batch:
+            try:
+                await self.messages.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                errors = e.details["writeErrors"]
+                if any(error["code"] != DUPLICATE_KEY for error in errors):
+                    raise
+                failed = {error["index"] for error in errors}
+                inserted = [item for idx, item in enumerate(batch) if idx not in failed]
+        for item in inserted:
+            self.on_insert(item)
+        progress.inserted += len(inserted)
+        progress.duplicates += size - len(inserted)
+        await self.checkpoints.update_one(
+            {"channel_id": channel.id},
+            {"$set": {"guild_id": channel.guild.id, "last_message_id": last_message_id},
+             "$inc": {"imported": len(inserted)}},
+            upsert=True)
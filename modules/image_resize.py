@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+# PIL format -> file extension
+FORMATS = {"JPEG": "jpg", "WEBP": "webp"}
+
+
+def encode(image, image_format, quality):
+    with BytesIO() as output:
+        image.save(output, image_format, quality=quality)
+        return output.getvalue()
+
+
+def fit_quality(image, limit, image_format, min_quality, max_quality):
+    """Binary search of the highest quality that fits in ``limit`` bytes.
+
+    Returns the encoded image (None if even ``min_quality`` is too large)
+    and the size of the smallest encoding tried.
+    """
+    best, smallest = None, None
+    low, high = min_quality, max_quality
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode(image, image_format, quality)
+        if len(data) <= limit:
+            best = data
+            low = quality + 1
+        else:
+            smallest = len(data)
+            high = quality - 1
+    return best, smallest
+
+
+def downscale(content, limit, image_format="JPEG", min_quality=60, max_quality=95):
+    """Re-encode an image to at most ``limit`` bytes.
+
+    The quality is lowered first and the resolution only when even
+    ``min_quality`` does not fit. Runs in a worker process; returns the new
+    bytes, their file extension and the CPU seconds spent.
+    """
+    from PIL import Image
+
+    start = time.process_time()
+    with Image.open(BytesIO(content)) as image:
+        original = image.convert("RGB")
+    image, scale = original, 1.0
+    while True:
+        data, smallest = fit_quality(image, limit, image_format, min_quality, max_quality)
+        if data is not None or scale < 0.05:
+            data = data or encode(image, image_format, min_quality)
+            return data, FORMATS[image_format], time.process_time() - start
+        # encoded size grows with the pixel count
+        scale *= min(0.9, (limit / smallest) ** 0.5)
+        image = original.resize((max(1, int(original.width * scale)), max(1, int(original.height * scale))),
+                                Image.LANCZOS)
+
+
+class ImageShrinker:
+    """Fits images into the upload limit in a process pool and counts the work done."""
+
+    def __init__(self, max_workers=1, image_format="JPEG", min_quality=60, max_quality=95):
+        self.max_workers = max_workers
+        self.image_format = image_format
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.executor = None
+        self.images = 0
+        self.bytes_saved = 0
+        self.cpu_time = 0.0
+
+    async def shrink(self, loop, content, limit):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.max_workers)
+        data, extension, cpu_time = await loop.run_in_executor(
+            self.executor, downscale, content, limit, self.image_format, self.min_quality, self.max_quality)
+        self.images += 1
+        self.bytes_saved += len(content) - len(data)
+        self.cpu_time += cpu_time
+        print(f"image shrunk from {len(content)} to {len(data)} bytes in {cpu_time:.2f}s of CPU time")
+        return data, extension
+
+    def stats(self):
+        return {
+            "images": self.images,
+            "saved": f"{self.bytes_saved / 2 ** 20:.1f} MiB",
+            "CPU time": f"{self.cpu_time:.1f}s",
+            "CPU time per image": f"{self.cpu_time / self.images if self.images else 0:.2f}s"
+        }
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -1,125 +1,264 @@
 import asyncio
 
-import pandas as pd
-import seaborn as sns
-from nextcord import ChannelType, Embed
-
+from config import (ACTIVITY_PLOT_CACHE_TTL, ACTIVITY_PLOT_WORKERS,
+                    IMPORT_BATCH_SIZE, IMPORT_BURST, IMPORT_RATE,
+                    MESSAGES_BATCH_SIZE, MESSAGES_BUFFER_SIZE,
+                    MESSAGES_FLUSH_INTERVAL_MS, MESSAGES_PUT_TIMEOUT,
+                    SCORES_FLUSH_INTERVAL, USERNAME_CACHE_SIZE,
+                    USERNAME_CACHE_TTL, USERNAME_FETCH_CONCURRENCY,
+                    VOICE_FLUSH_INTERVAL, WORDS_GUILD_SKETCH_WIDTH,
+                    WORDS_MAX_USERS, WORDS_MIN_LENGTH, WORDS_PERSIST_INTERVAL,
+                    WORDS_SKETCH_DEPTH, WORDS_TOP_CAPACITY,
+                    WORDS_USER_SKETCH_WIDTH)
+from bson import ObjectId
+from modules.activity_plot import PERIODS, ActivityPlotter, bucket_start
+from modules.db_indexes import ensure_indexes, explain_analysis_queries
+from modules.history_import import HistoryImporter
+from modules.rate_limit import TokenBucket
+from modules.ttl_cache import TTLCache
+from modules.user_names import UserNameResolver
+from modules.voice_sessions import VoiceSessionTracker
+from modules.word_stats import WordIndex
+from modules.write_buffer import IncrementBuffer, WriteBuffer
+from nextcord import Embed
+from nextcord.utils import utcnow
+from pymongo import DESCENDING, ReplaceOne
 
 
 def time_to_str(time):
     return f"{int(time // 60)} h, {int(time % 60)} min"
 
 
+def message_score(content, attachments_number):
+    return len(content) * 0.1 + attachments_number * 5
+
+
+def message_document(message):
+    return {
+        "_id": ObjectId(),
+        "message_id": message.id,
+        "guild_id": message.guild.id,
+        "timestamp": message.created_at,
+        "author_id": message.author.id,
+        "is_bot": message.author.bot,
+        "channel_id": message.channel.id,
+        "content": message.content,
+        "attachments_number": len(message.attachments)
+    }
+
+
+def user_scores_pipeline(guild_id, boundary=None):
+    match = {"guild_id": guild_id, "is_bot": False}
+    if boundary is not None:
+        match["_id"] = {"$lte": boundary}
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": "$author_id",
+            "score": {"$sum": {"$add": [
+                {"$multiply": [{"$strLenCP": {"$ifNull": ["$content", ""]}}, 0.1]},
+                {"$multiply": [{"$ifNull": ["$attachments_number", 0]}, 5]}]}},
+            "messages": {"$sum": 1}}}
+    ]
+
+
+def voice_activity_pipeline(guild_id, now, limit=10):
+    # open sessions count until now
+    return [
+        {"$match": {"guild_id": guild_id}},
+        {"$group": {"_id": "$user_id", "activity_minutes": {"$sum": {"$cond": [
+            {"$eq": ["$session_active", True]},
+            {"$divide": [{"$subtract": [now, "$started_at"]}, 60000]},
+            "$activity_minutes"]}}}},
+        {"$sort": {"activity_minutes": -1}},
+        {"$limit": limit}
+    ]
+
+
 class AnalysisModule:
     def __init__(self, client, db):
         self.discord_client = client
         self.voice_activity_collection = db["voice_activity"]
         self.messages_collection = db["messages"]
+        self.messages_buffer = WriteBuffer(client.loop, self.messages_collection,
+                                           batch_size=MESSAGES_BATCH_SIZE,
+                                           flush_interval=MESSAGES_FLUSH_INTERVAL_MS / 1000,
+                                           max_size=MESSAGES_BUFFER_SIZE,
+                                           put_timeout=MESSAGES_PUT_TIMEOUT)
+        self.user_scores_collection = db["user_scores"]
+        self.scores = IncrementBuffer(self.user_scores_collection, ("guild_id", "author_id"))
+        # guilds whose user_scores are being rebuilt, their increments are not flushed
+        self.rebuilding = set()
+        self.rollups_collection = db["activity_rollups"]
+        self.rollups = IncrementBuffer(self.rollups_collection,
+                                       ("guild_id", "user_id", "period", "bucket", "channel_id"))
+        self.words = WordIndex(db["word_stats"], guild_width=WORDS_GUILD_SKETCH_WIDTH,
+                               user_width=WORDS_USER_SKETCH_WIDTH, depth=WORDS_SKETCH_DEPTH,
+                               capacity=WORDS_TOP_CAPACITY, min_length=WORDS_MIN_LENGTH,
+                               max_users=WORDS_MAX_USERS)
+        self.importer = HistoryImporter(self.messages_collection, db["import_checkpoints"],
+                                        message_document, self.count_message, self.messages_buffer.flush,
+                                        TokenBucket(IMPORT_RATE, IMPORT_BURST),
+                                        batch_size=IMPORT_BATCH_SIZE)
+        self.plotter = ActivityPlotter(TTLCache(256, ACTIVITY_PLOT_CACHE_TTL),
+                                       max_workers=ACTIVITY_PLOT_WORKERS)
+        self.voice_tracker = VoiceSessionTracker(client.loop, self.voice_activity_collection,
+                                                 flush_interval=VOICE_FLUSH_INTERVAL)
+        self.user_names = UserNameResolver(client, cache_size=USERNAME_CACHE_SIZE,
+                                           ttl=USERNAME_CACHE_TTL,
+                                           concurrency=USERNAME_FETCH_CONCURRENCY)
         self.db = db
-        client.loop.create_task(self.voice_activity_check())
+        # score upserts wait for it, the unique index keeps them from creating duplicates
+        self.indexes = client.loop.create_task(self.create_indexes())
+        client.loop.create_task(self.counters_flush_loop())
+        client.loop.create_task(self.words_persist_loop())
 
-    def __del__(self):
-        self.voice_activity_collection.update_many(
-            {"session_ended": False}, {"$set": {"session_ended": True}})
+    async def create_indexes(self):
+        try:
+            await self.db.run("ensure_indexes", ensure_indexes, self.db.sync)
+        except Exception as e:
+            print(f"creating analysis indexes failed: {e!r}")
+
+    def close(self):
+        self.messages_buffer.close()
+        self.scores.close()
+        self.rollups.close()
+        self.words.close()
+        self.voice_tracker.close_all()
+        self.plotter.close()
+        self.db.close()
+
+    def stats(self):
+        return {
+            "Message buffer": self.messages_buffer.stats(),
+            "User names": self.user_names.stats(),
+            "Mongo latency": self.db.stats()
+        }
+
+    async def explain_queries(self, guild_id, user_id):
+        return await self.db.run("explain", explain_analysis_queries, self.db.sync, guild_id, user_id)
 
     async def get_voice_activity(self, ctx):
-        try:
-            df = pd.DataFrame(list(self.voice_activity_collection.find(
-                {"guild_id": ctx.guild.id},
-                ["user_id", "activity_minutes"])))
-            df = df.groupby(["user_id"]).sum().sort_values(
-                "activity_minutes", ascending=False).head(10)
-            df = df.sort_values("activity_minutes", ascending=False).head(10)
-            df = df.reset_index()
+        await self.voice_tracker.flush()
+        rows = await self.voice_activity_collection.aggregate(
+            voice_activity_pipeline(ctx.guild.id, utcnow().replace(tzinfo=None)))
+        if rows:
+            names = await self.user_names.resolve(ctx.guild, [item["_id"] for item in rows])
             answer = "```"
-            for item in df.itertuples():
-                user = await self.discord_client.fetch_user(item.user_id)
-                answer += f"#{str(item.Index + 1)} {user} - {time_to_str(item.activity_minutes)}\n"
+            for idx, item in enumerate(rows):
+                answer += f"#{str(idx + 1)} {names[item['_id']]} - {time_to_str(item['activity_minutes'])}\n"
             answer += "```"
             embed = Embed(title="Voice activity", description=answer)
-        except KeyError:
+        else:
             embed = Embed(title="Voice activity", description="Empty.")
         await ctx.send(embed=embed)
 
-    async def get_activity_date_plot(self, ctx):
-        df = pd.DataFrame(list(self.messages_collection.find(
-                {"guild_id": ctx.guild.id, "author_id": ctx.author_id},
-                ["author_id", "content", "attachments_number", "timestamp"])))
-        print(df.dtypes)
-        answer = ''
-        return answer
+    async def get_activity_date_plot(self, guild, user, days):
+        """PNG with messages of the user per channel for the last days, None if there are none."""
+        period = "hour" if days <= 3 else "day"
+        end = bucket_start(utcnow().replace(tzinfo=None), period)
+        start = end - PERIODS[period][1] * (days * 24 if period == "hour" else days - 1)
+        await self.rollups.flush(lambda key: key[0] == guild.id and key[1] == user.id)
+        rows = await self.rollups_collection.find(
+            {"guild_id": guild.id, "user_id": user.id, "period": period,
+             "bucket": {"$gte": start, "$lte": end}},
+            {"_id": False, "bucket": True, "channel_id": True, "messages": True})
+        if not rows:
+            return None
+        channels = {}
+        for item in rows:
+            channel = guild.get_channel(item["channel_id"])
+            channels[item["channel_id"]] = f"#{channel.name}" if channel is not None else str(item["channel_id"])
+        key = (guild.id, user.id, period, start, end)
+        return await self.plotter.render(self.discord_client.loop, key, rows, channels, start, end, period,
+                                         f"{user.display_name}: messages for {days} days")
 
-    async def voice_activity_check(self):
+    async def save_message(self, ctx):
+        new_item = message_document(ctx)
+        await self.messages_buffer.put(new_item)
+        self.count_message(new_item)
+
+    def count_message(self, item):
+        if item["is_bot"]:
+            return
+        self.scores.add((item["guild_id"], item["author_id"]),
+                        score=message_score(item["content"], item["attachments_number"]), messages=1)
+        for period in PERIODS:
+            self.rollups.add((item["guild_id"], item["author_id"], period,
+                              bucket_start(item["timestamp"], period), item["channel_id"]),
+                             messages=1, characters=len(item["content"]),
+                             attachments=item["attachments_number"])
+        self.words.add(item["guild_id"], item["author_id"], item["content"])
+
+    async def counters_flush_loop(self):
+        await self.indexes
         while True:
-            active_users = self.get_active_voice_users()
-
-            for item in self.voice_activity_collection.find(
-                    {"session_active": True}):
-                guild_id = int(item["guild_id"])
-                user = int(item["user_id"])
-                if guild_id in active_users:
-                    if user not in active_users[guild_id]:
-                        self.voice_activity_collection.update_one(
-                            {"_id": item["_id"]},
-                            {"$set": {"session_active": False}})
-                    else:
-                        self.voice_activity_collection.update_one(
-                            {'_id': item['_id']},
-                            {'$inc': {'activity_minutes': 1}},
-                            upsert=False)
-                        active_users[guild_id].pop(user)
-
-            for guild_id in active_users:
-                for uid, user in active_users[guild_id].items():
-                    new_item = {
-                        "guild_id": guild_id,
-                        "user_id": uid,
-                        "is_bot": user.bot,
-                        "activity_minutes": 0,
-                        "session_active": True
-                    }
-                    self.voice_activity_collection.insert_one(new_item)
-            await asyncio.sleep(60)
-
-    def get_active_voice_users(self):
-        active_users = {}
-        for guild in self.discord_client.guilds:
-            guild_active_users = {}
-            for channel in guild.channels:
-                if channel.type == ChannelType.voice:
-                    for user in channel.members:
-                        guild_active_users[user.id] = user
-            active_users[guild.id] = guild_active_users
-        return active_users
-
-    def save_message(self, ctx):
-        new_item = {
-            "guild_id": ctx.guild.id,
-            "timestamp": ctx.created_at,
-            "author_id": ctx.author.id,
-            "is_bot": ctx.author.bot,
-            "channel_id": ctx.channel.id,
-            "content": ctx.content,
-            "attachments_number": len(ctx.attachments)
-        }
-        self.messages_collection.insert_one(new_item)
+            await asyncio.sleep(SCORES_FLUSH_INTERVAL)
+            for name, counters, match in (("user scores", self.scores, lambda key: key[0] not in self.rebuilding),
+                                          ("activity rollups", self.rollups, None)):
+                try:
+                    await counters.flush(match)
+                except Exception as e:
+                    print(f"{name} flush failed: {e}")
 
-    async def get_user_scores(self, ctx):
+    async def words_persist_loop(self):
+        while True:
+            if not self.words.loaded:
+                try:
+                    await self.words.load()
+                except Exception as e:
+                    print(f"word stats load failed: {e!r}")
+            await asyncio.sleep(WORDS_PERSIST_INTERVAL)
+            try:
+                await self.words.persist()
+            except Exception as e:
+                print(f"word stats persist failed: {e}")
+
+    async def rebuild_user_scores(self, guild_id):
+        await self.indexes
+        # increments are held until the rebuilt scores are written, $inc on top of them
+        self.rebuilding.add(guild_id)
         try:
-            df = pd.DataFrame(list(self.messages_collection.find(
-                {"guild_id": ctx.guild.id, "is_bot": False},
-                ["author_id", "content", "attachments_number"])))
-            df["length"] = df["content"].apply(lambda x: len(x))
-            df["score"] = df["length"] * 0.1 + df["attachments_number"] * 5
-            df = df.groupby(["author_id"]).sum().sort_values(
-                "score", ascending=False).head(10)
-            df = df.reset_index()
+            # ids are assigned when a message is counted: messages up to the boundary are
+            # recounted from the collection, later ones only by their pending increments
+            boundary = ObjectId()
+            counted = self.scores.take(lambda key: key[0] == guild_id)
+            try:
+                await self.messages_buffer.flush()
+                rows = await self.messages_collection.aggregate(user_scores_pipeline(guild_id, boundary),
+                                                                allowDiskUse=True)
+            except Exception:
+                for key, counters in counted.items():
+                    self.scores.add(key, **counters)
+                raise
+            operations = [ReplaceOne({"guild_id": guild_id, "author_id": item["_id"]},
+                                     {"guild_id": guild_id, "author_id": item["_id"],
+                                      "score": item["score"], "messages": item["messages"]},
+                                     upsert=True)
+                          for item in rows]
+            if operations:
+                await self.user_scores_collection.bulk_write(operations, ordered=False)
+            await self.user_scores_collection.delete_many(
+                {"guild_id": guild_id, "author_id": {"$nin": [item["_id"] for item in rows]}})
+        finally:
+            self.rebuilding.discard(guild_id)
+        return len(rows)
+
+    async def get_user_scores(self, ctx):
+        await self.indexes
+        if ctx.guild.id not in self.rebuilding:
+            await self.scores.flush(lambda key: key[0] == ctx.guild.id)
+        rows = await self.user_scores_collection.find(
+            {"guild_id": ctx.guild.id}, ["author_id", "score"],
+            sort=[("score", DESCENDING)], limit=10)
+        if rows:
+            names = await self.user_names.resolve(ctx.guild, [item["author_id"] for item in rows])
             answer = "```"
-            for item in df.itertuples():
-                answer += f"#{str(item.Index + 1)} {await self.discord_client.fetch_user(item.author_id)} - {int(item.score)}\n"
+            for idx, item in enumerate(rows):
+                answer += f"#{str(idx + 1)} {names[item['author_id']]} - {int(item['score'])}\n"
 
             answer += "```"
             embed = Embed(title="Top", description=answer)
-        except KeyError:
+        else:
             embed = Embed(title="Top", description="Empty.")
         await ctx.response.send_message(embed=embed)
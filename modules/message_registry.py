@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+# namespace -> MessageRegistry, shared by every cog listening to reactions
+REGISTRIES = {}
+
+
+class MessageRegistry:
+    """Messages sent by the bot that handle reactions: message id -> [kind, data].
+
+    Reaction listeners look the message up here before any REST call, so
+    reactions on other messages cost nothing. The ``maxsize`` most recently
+    used entries are kept and mirrored to a StateStore namespace to
+    survive restarts.
+    """
+
+    def __init__(self, store, maxsize=10000, namespace='reaction_messages'):
+        self.store = store
+        self.maxsize = maxsize
+        self.namespace = namespace
+        # snowflakes grow with time, so the oldest messages come first
+        self.entries = OrderedDict(sorted((int(key), value) for key, value in store.load(namespace).items()))
+        self.evict()
+
+    def add(self, message_id, kind, data=None):
+        self.entries[message_id] = [kind, data]
+        self.entries.move_to_end(message_id)
+        self.store.put(self.namespace, str(message_id), [kind, data])
+        self.evict()
+
+    def get(self, message_id):
+        entry = self.entries.get(message_id)
+        if entry is not None:
+            self.entries.move_to_end(message_id)
+        return entry
+
+    def pop(self, message_id):
+        if self.entries.pop(message_id, None) is not None:
+            self.store.remove(self.namespace, str(message_id))
+
+    def evict(self):
+        while len(self.entries) > self.maxsize:
+            message_id, _ = self.entries.popitem(last=False)
+            self.store.remove(self.namespace, str(message_id))
+
+    def stats(self):
+        return {
+            "messages": len(self.entries),
+            "size": self.maxsize
+        }
+
+
+def open_registry(store, maxsize=10000, namespace='reaction_messages'):
+    if namespace not in REGISTRIES:
+        REGISTRIES[namespace] = MessageRegistry(store, maxsize, namespace)
+    return REGISTRIES[namespace]
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+import pymongo
+
+
+class LatencyHistogram:
+    """Operation latencies counted in fixed buckets (upper bounds in seconds)."""
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations."""
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return "no calls"
+        return (f"n={self.count} p50<={self.percentile(0.5) * 1000:g}ms "
+                f"p95<={self.percentile(0.95) * 1000:g}ms max={self.max * 1000:.0f}ms")
+
+
+class AsyncCollection:
+    """Awaitable wrapper of a pymongo collection.
+
+    Every call runs in the executor of its AsyncDatabase; cursors are read
+    completely there and returned as lists. ``sync`` is the wrapped
+    collection for code that must not wait for the loop (e.g. shutdown).
+    """
+
+    def __init__(self, database, collection):
+        self.database = database
+        self.sync = collection
+        self.name = collection.name
+
+    def run(self, operation, func, *args, **kwargs):
+        return self.database.run(f"{self.name}.{operation}", func, *args, **kwargs)
+
+    def read_find(self, query, projection=None, sort=None, limit=0):
+        cursor = self.sync.find(query, projection)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    async def find(self, query, projection=None, sort=None, limit=0):
+        return await self.run("find", self.read_find, query, projection, sort, limit)
+
+    async def find_batches(self, query, projection=None, batch_size=1000):
+        """Yield the results as lists of up to batch_size documents, one at a time."""
+        cursor = self.sync.find(query, projection, batch_size=batch_size)
+        try:
+            while True:
+                batch = await self.run("find_batch", lambda: list(islice(cursor, batch_size)))
+                if not batch:
+                    break
+                yield batch
+        finally:
+            cursor.close()
+
+    async def find_one(self, query, projection=None):
+        return await self.run("find_one", self.sync.find_one, query, projection)
+
+    async def aggregate(self, pipeline, **kwargs):
+        return await self.run("aggregate", lambda: list(self.sync.aggregate(pipeline, **kwargs)))
+
+    async def insert_one(self, document):
+        return await self.run("insert_one", self.sync.insert_one, document)
+
+    async def insert_many(self, documents, ordered=True):
+        return await self.run("insert_many", self.sync.insert_many, documents, ordered=ordered)
+
+    async def update_one(self, query, update, upsert=False):
+        return await self.run("update_one", self.sync.update_one, query, update, upsert=upsert)
+
+    async def update_many(self, query, update, upsert=False):
+        return await self.run("update_many", self.sync.update_many, query, update, upsert=upsert)
+
+    async def delete_many(self, query):
+        return await self.run("delete_many", self.sync.delete_many, query)
+
+    async def bulk_write(self, requests, ordered=True):
+        return await self.run("bulk_write", self.sync.bulk_write, requests, ordered=ordered)
+
+    async def create_index(self, keys, **kwargs):
+        return await self.run("create_index", self.sync.create_index, keys, **kwargs)
+
+
+class AsyncDatabase:
+    """pymongo database whose operations run in a bounded thread pool.
+
+    Latency of every operation, including the time it waited for a free
+    worker, is recorded per "collection.operation" name.
+    """
+
+    def __init__(self, db, max_workers=4):
+        self.sync = db
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="mongo")
+        self.collections = {}
+        self.histograms = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = AsyncCollection(self, self.sync[name])
+        return self.collections[name]
+
+    async def run(self, operation, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, partial(func, *args, **kwargs))
+        finally:
+            self.histograms.setdefault(operation, LatencyHistogram()).observe(time.perf_counter() - start)
+
+    def stats(self):
+        return {operation: histogram.summary()
+                for operation, histogram in sorted(self.histograms.items())}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def connect(address, name, max_pool_size=100, max_workers=4):
+    client = pymongo.MongoClient(address, maxPoolSize=max_pool_size)
+    return AsyncDatabase(client[name], max_workers=max_workers)
@@ -37,8 +37,9 @@ REQUESTS_KWARGS = {
 }
 
 
-def refresh_token(refresh_token):
-    response = requests.post(
+async def refresh_token(session, refresh_token):
+    """Exchange a refresh token; returns the new refresh token, access token and its ttl."""
+    async with session.post(
         AUTH_TOKEN_URL,
         data={
             "client_id": CLIENT_ID,
@@ -48,15 +49,11 @@ def refresh_token(refresh_token):
             "refresh_token": refresh_token,
         },
         headers={"User-Agent": USER_AGENT},
-    )
-    data = response.json()
-    ttl = 0
-    try:
-        refresh_token = data["refresh_token"]
-        ttl = data.get("expires_in", 0)
-    except KeyError:
-        print("unable to get pixiv refresh token!")
-    return refresh_token, ttl
+    ) as response:
+        data = await response.json(content_type=None)
+    if "refresh_token" not in data:
+        raise RuntimeError(f"unable to refresh pixiv token: {response.status} {data}")
+    return data["refresh_token"], data["access_token"], data.get("expires_in", 0)
 
 
 def s256(data):
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from modules.mongo import LatencyHistogram
+from modules.rate_limit import TokenBucket
+
+
+class TooManyRequests(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__(f"429 Too Many Requests (retry after {retry_after})")
+        self.retry_after = retry_after
+
+
+class DownloadPool:
+    """Image downloads limited per Pixiv token and in total.
+
+    Every token gets its own TokenBucket of ``rate`` downloads per second
+    with ``burst`` allowed at once, so a busy guild only delays guilds that
+    share its token. At most ``concurrency`` transfers run at the same time.
+    A 429 response empties the token's bucket and the download is retried
+    up to ``retries`` times.
+    """
+
+    def __init__(self, rate=2.0, burst=5, concurrency=8, retries=3):
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.buckets = {}
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queue_wait = LatencyHistogram()
+        self.waiting = 0
+        self.in_flight = 0
+        self.downloads = 0
+        self.failed = 0
+        self.throttled = 0
+
+    def bucket(self, key):
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return self.buckets[key]
+
+    async def wait_turn(self, key):
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self.bucket(key).acquire()
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.queue_wait.observe(time.monotonic() - start)
+
+    async def download(self, key, fetch, *args):
+        """Await ``fetch(*args)`` once the token ``key`` and a free slot allow it."""
+        for attempt in range(self.retries + 1):
+            await self.wait_turn(key)
+            self.in_flight += 1
+            try:
+                result = await fetch(*args)
+                self.downloads += 1
+                return result
+            except TooManyRequests as e:
+                self.throttled += 1
+                bucket = self.bucket(key)
+                bucket.refill()
+                bucket.tokens = min(bucket.tokens, 0) - (e.retry_after or 0) * bucket.rate
+                if attempt == self.retries:
+                    self.failed += 1
+                    raise
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                self.semaphore.release()
+
+    def stats(self):
+        return {
+            "waiting": self.waiting,
+            "in flight": self.in_flight,
+            "downloads": self.downloads,
+            "failed": self.failed,
+            "429 responses": self.throttled,
+            "tokens": len(self.buckets),
+            "queue wait": self.queue_wait.summary()
+        }
@@ -0,0 +1,99 @@
+import asyncio
+
+import modules.date as date
+
+DONE = object()
+
+
+class SearchStats:
+    def __init__(self):
+        self.pages = 0
+        self.scanned = 0
+        self.accepted = 0
+        self.timed_out = False
+
+    def describe(self):
+        text = (f'{self.pages} pages fetched, {self.scanned} images scanned, '
+                f'{self.accepted} images shown')
+        if self.timed_out:
+            text += '\nSearch stopped by time limit'
+        return text
+
+
+async def search_pages(api, word, match, selected_date, max_pages):
+    """Yield search_illust result pages going forward in time.
+
+    When the results before ``selected_date`` run out the search continues
+    a year later, until today is reached or ``max_pages`` requests were made.
+    """
+    offset = 0
+    for _ in range(max_pages):
+        query = await api.search_illust(word, search_target=match, end_date=selected_date, offset=offset)
+        if query.illusts is None:
+            return
+        if len(query.illusts) == 0:
+            if selected_date >= date.current():
+                return
+            selected_date = date.next_year(selected_date)
+            offset = 0
+            continue
+        yield query
+        offset += len(query.illusts)
+
+
+async def prefetch(pages, size=1):
+    """Iterate an async generator while up to ``size`` next items are fetched in the background."""
+    queue = asyncio.Queue(size)
+
+    async def produce():
+        try:
+            async for page in pages:
+                await queue.put((page, None))
+            await queue.put((DONE, None))
+        except Exception as e:
+            await queue.put((DONE, e))
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            page, error = await queue.get()
+            if error is not None:
+                raise error
+            if page is DONE:
+                return
+            yield page
+    finally:
+        producer.cancel()
+
+
+async def run_search(pages, accept, sink, limit, budget, prefetch_pages=1):
+    """Pass illusts of ``pages`` that satisfy ``accept`` to ``sink``.
+
+    Stops once ``limit`` illusts were accepted or after ``budget`` seconds;
+    stopping or cancelling the search also cancels the page prefetch.
+    """
+    stats = SearchStats()
+    seen = set()
+
+    async def consume():
+        fetched = prefetch(pages, prefetch_pages)
+        try:
+            async for page in fetched:
+                stats.pages += 1
+                for illust in page.illusts:
+                    stats.scanned += 1
+                    if illust.id in seen or not accept(illust):
+                        continue
+                    seen.add(illust.id)
+                    stats.accepted += 1
+                    await sink(illust)
+                    if stats.accepted == limit:
+                        return
+        finally:
+            await fetched.aclose()
+
+    try:
+        await asyncio.wait_for(consume(), budget)
+    except asyncio.TimeoutError:
+        stats.timed_out = True
+    return stats
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from collections import deque
+
+
+class RecommendationPrefetcher:
+    """Keeps recommendation pages of every guild fetched ahead of time.
+
+    ``fetch(key, next_url)`` returns a page, following ``next_url`` of the
+    previous page when it is given. ``take`` serves the oldest buffered
+    page immediately and, when fewer than ``low_water`` pages are left,
+    refills the buffer up to ``pages`` in the background. With an empty
+    buffer the page is taken from a running refill or fetched directly;
+    pages are fetched one at a time per key, so a ``next_url`` is never
+    followed twice. Pages older than ``ttl`` seconds are dropped. Callers
+    taking pages less often than ``ttl`` pass ``refill=False`` and call
+    ``refill`` shortly before they need the next page.
+    """
+
+    def __init__(self, fetch, pages=2, low_water=1, ttl=1800):
+        self.fetch = fetch
+        self.pages = pages
+        self.low_water = low_water
+        self.ttl = ttl
+        # key -> deque of (fetch time, page)
+        self.buffers = {}
+        self.next_urls = {}
+        self.refills = {}
+        self.locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def fetch_page(self, key):
+        page = await self.fetch(key, self.next_urls.get(key))
+        self.next_urls[key] = page.next_url
+        return page
+
+    async def take(self, key, refill=True):
+        buffer = self.buffers.setdefault(key, deque())
+        while buffer and buffer[0][0] + self.ttl < time.monotonic():
+            buffer.popleft()
+        if buffer:
+            self.hits += 1
+            page = buffer.popleft()[1]
+        else:
+            self.misses += 1
+            async with self.locks.setdefault(key, asyncio.Lock()):
+                # a running refill may have fetched a page while we waited
+                page = buffer.popleft()[1] if buffer else await self.fetch_page(key)
+        if refill:
+            self.refill(key)
+        return page
+
+    def refill(self, key, pages=None):
+        """Fill the buffer up to ``pages`` (default ``self.pages``) in the background if it is low."""
+        buffer = self.buffers.setdefault(key, deque())
+        task = self.refills.get(key)
+        if len(buffer) < self.low_water and (task is None or task.done()):
+            self.refills[key] = asyncio.ensure_future(self.fill(key, pages or self.pages))
+
+    async def fill(self, key, pages):
+        buffer = self.buffers[key]
+        try:
+            while len(buffer) < pages:
+                async with self.locks.setdefault(key, asyncio.Lock()):
+                    buffer.append((time.monotonic(), await self.fetch_page(key)))
+        except Exception as e:
+            print(f"prefetching recommendations of {key} failed: {e!r}")
+
+    def drop(self, key):
+        task = self.refills.pop(key, None)
+        if task is not None:
+            task.cancel()
+        self.buffers.pop(key, None)
+        self.next_urls.pop(key, None)
+        self.locks.pop(key, None)
+
+    def close(self):
+        for task in self.refills.values():
+            task.cancel()
+
+    def stats(self):
+        return {
+            "guilds": len(self.buffers),
+            "buffered pages": sum(len(buffer) for buffer in self.buffers.values()),
+            "hits": self.hits,
+            "misses": self.misses
+        }
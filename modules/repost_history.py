@@ -0,0 +1,161 @@
+import asyncio
+import math
+import os
+
+import numpy as np
+from modules.disk_cache import write_file
+
+MASK64 = 2 ** 64 - 1
+
+
+def splitmix64(value):
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+class BloomFilter:
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = np.zeros((bits + 7) // 8, dtype=np.uint8)
+
+    def positions(self, value):
+        first = splitmix64(value & MASK64)
+        second = splitmix64(first) | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+    def clear(self):
+        self.array.fill(0)
+
+
+class RepostHistory:
+    """The last ``size`` illust ids posted in a guild.
+
+    Ids are kept in an int64 ring and in two Bloom filters that each cover
+    half of the ring: new ids go to the current filter, and when it holds
+    ``size // 2`` ids the older filter is cleared and becomes the current
+    one. Lookups and inserts are O(1) and remember at least the last
+    ``size // 2`` and at most the last ``size`` ids. Each filter wrongly
+    reports an id as present with probability ``error_rate``, so a lookup
+    does with up to twice that once both are full.
+
+    Memory is ``8 * size`` bytes for the ring plus about
+    ``1.44 * log2(1 / error_rate) * size / 8`` bytes for the filters, e.g.
+    191 KiB for 20000 ids at an error rate of 0.001.
+    """
+
+    def __init__(self, size, error_rate=0.001):
+        self.size = size
+        self.generation = max(1, size // 2)
+        bits = math.ceil(-self.generation * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(bits / self.generation * math.log(2)))
+        self.filters = [BloomFilter(bits, hashes), BloomFilter(bits, hashes)]
+        self.ring = np.zeros(size, dtype=np.int64)
+        self.count = 0
+
+    def __contains__(self, illust_id):
+        return any(illust_id in bloom for bloom in self.filters)
+
+    def add(self, illust_id):
+        if self.count and self.count % self.generation == 0:
+            previous = self.filters.pop()
+            previous.clear()
+            self.filters.insert(0, previous)
+        self.ring[self.count % self.size] = illust_id
+        self.count += 1
+        self.filters[0].add(illust_id)
+
+    def nbytes(self):
+        return self.ring.nbytes + sum(bloom.array.nbytes for bloom in self.filters)
+
+    def recent(self):
+        """Remembered ids, oldest first."""
+        if self.count <= self.size:
+            return self.ring[:self.count]
+        start = self.count % self.size
+        return np.concatenate((self.ring[start:], self.ring[:start]))
+
+    def to_bytes(self):
+        return np.concatenate(([self.count], self.ring)).astype(np.int64).tobytes()
+
+    @classmethod
+    def from_bytes(cls, content, size, error_rate=0.001):
+        data = np.frombuffer(content, dtype=np.int64)
+        stored = cls(len(data) - 1, error_rate)
+        stored.count, stored.ring = int(data[0]), data[1:].copy()
+        history = cls(size, error_rate)
+        # filters are not stored, the ids are added again in their order
+        for illust_id in stored.recent()[-size:]:
+            history.add(int(illust_id))
+        return history
+
+
+class RepostHistoryStore:
+    """RepostHistory of every guild, snapshotted to ``directory`` by ``persist``."""
+
+    def __init__(self, directory, size, error_rate=0.001):
+        self.directory = directory
+        self.size = size
+        self.error_rate = error_rate
+        self.histories = {}
+        self.dirty = set()
+
+    def path(self, guild_id):
+        return os.path.join(self.directory, f'{guild_id}.bin')
+
+    def get(self, guild_id):
+        if guild_id not in self.histories:
+            history = None
+            if os.path.exists(self.path(guild_id)):
+                try:
+                    with open(self.path(guild_id), 'rb') as file:
+                        history = RepostHistory.from_bytes(file.read(), self.size, self.error_rate)
+                except (OSError, ValueError) as e:
+                    print(f"can't load repost history of {guild_id}: {e!r}")
+            self.histories[guild_id] = history or RepostHistory(self.size, self.error_rate)
+        return self.histories[guild_id]
+
+    def contains(self, guild_id, illust_id):
+        return illust_id in self.get(guild_id)
+
+    def seen(self, guild_id, illust_id):
+        """Whether the illust was posted in the guild; remembers it if not."""
+        history = self.get(guild_id)
+        if illust_id in history:
+            return True
+        history.add(illust_id)
+        self.dirty.add(guild_id)
+        return False
+
+    def take_snapshots(self):
+        guilds, self.dirty = self.dirty, set()
+        return [(self.path(guild_id), self.histories[guild_id].to_bytes()) for guild_id in guilds]
+
+    @staticmethod
+    def write(snapshots):
+        for path, content in snapshots:
+            write_file(path, content)
+
+    async def persist(self):
+        snapshots = self.take_snapshots()
+        if snapshots:
+            await asyncio.to_thread(self.write, snapshots)
+
+    def close(self):
+        self.write(self.take_snapshots())
+
+    def stats(self):
+        return {
+            "guilds": len(self.histories),
+            "remembered": sum(min(history.count, history.size) for history in self.histories.values()),
+            "memory": f"{sum(history.nbytes() for history in self.histories.values()) / 2 ** 10:.0f} KiB"
+        }
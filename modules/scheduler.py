@@ -0,0 +1,60 @@
+import asyncio
+import contextlib
+import heapq
+import time
+
+
+class Scheduler:
+    """Calls ``callback(key)`` at the time every key is scheduled for.
+
+    Keys wait in a min-heap ordered by their epoch time, and ``run`` sleeps
+    until the earliest one is due or the schedule changes. Due callbacks
+    run concurrently, at most ``concurrency`` at once. A key has one pending
+    time; rescheduling or cancelling it leaves a stale heap entry that is
+    skipped when it reaches the top.
+    """
+
+    def __init__(self, callback, concurrency=4):
+        self.callback = callback
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.heap = []
+        # key -> time it is due at
+        self.due = {}
+        self.wakeup = asyncio.Event()
+        self.running = set()
+
+    def schedule(self, key, when):
+        self.due[key] = when
+        heapq.heappush(self.heap, (when, key))
+        self.wakeup.set()
+
+    def cancel(self, key):
+        self.due.pop(key, None)
+
+    def next_time(self, key):
+        return self.due.get(key)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                continue
+            _, key = heapq.heappop(self.heap)
+            self.due.pop(key)
+            await self.semaphore.acquire()
+            task = asyncio.ensure_future(self.fire(key))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def fire(self, key):
+        try:
+            await self.callback(key)
+        except Exception as e:
+            print(f"scheduled task {key} failed: {e!r}")
+        finally:
+            self.semaphore.release()
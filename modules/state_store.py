@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+# path -> StateStore, so every cog writes through the same connection
+STORES = {}
+
+
+class StateStore:
+    """Key-value state of the cogs in an SQLite database in WAL mode.
+
+    Every namespace is a dict of JSON values. ``update`` compares a dict
+    with what was last written and queues only the changed and removed
+    keys, ``put`` and ``remove`` queue a single key. Queued changes are
+    written in one transaction ``delay`` seconds later, so bursts of
+    updates cost a single commit; a failed write is queued again. Writes
+    run in a dedicated thread, ``commit`` writes synchronously (e.g. on
+    unload).
+    """
+
+    def __init__(self, path, delay=1.0):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS state (namespace TEXT, key TEXT, value TEXT, "
+                                "PRIMARY KEY (namespace, key))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS imported (namespace TEXT PRIMARY KEY)")
+        self.connection.commit()
+        self.delay = delay
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="state")
+        # namespace -> {key: json text} as stored
+        self.snapshots = {}
+        # (namespace, key) -> json text, None removes the key
+        self.pending = {}
+        self.flush_handle = None
+        self.commits = 0
+
+    def load(self, namespace, legacy_json=None):
+        """Read a namespace; an empty one is filled from ``legacy_json`` if that file exists."""
+        rows = self.executor.submit(self.read, namespace, legacy_json).result()
+        self.snapshots[namespace] = dict(rows)
+        return {key: json.loads(value) for key, value in rows}
+
+    def read(self, namespace, legacy_json):
+        rows = self.connection.execute("SELECT key, value FROM state WHERE namespace = ?", (namespace,)).fetchall()
+        # a legacy file is imported once, an emptied namespace must stay empty
+        if self.connection.execute("SELECT 1 FROM imported WHERE namespace = ?", (namespace,)).fetchone():
+            return rows
+        if not rows and legacy_json is not None and os.path.exists(legacy_json):
+            try:
+                with open(legacy_json, 'r') as file:
+                    data = json.load(file)
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"can't import {legacy_json}: {e!r}")
+                return rows
+            rows = [(str(key), json.dumps(value)) for key, value in data.items()]
+            with self.connection:
+                self.connection.executemany("INSERT INTO state VALUES (?, ?, ?)",
+                                            [(namespace, key, value) for key, value in rows])
+                self.connection.execute("INSERT INTO imported VALUES (?)", (namespace,))
+            print(f"imported {len(rows)} items of {namespace} from {legacy_json}")
+            return rows
+        with self.connection:
+            self.connection.execute("INSERT INTO imported VALUES (?)", (namespace,))
+        return rows
+
+    def update(self, namespace, data):
+        snapshot = self.snapshots.setdefault(namespace, {})
+        for key, value in data.items():
+            text = json.dumps(value)
+            if snapshot.get(key) != text:
+                snapshot[key] = text
+                self.pending[(namespace, key)] = text
+        for key in [key for key in snapshot if key not in data]:
+            del snapshot[key]
+            self.pending[(namespace, key)] = None
+        if self.pending:
+            self.schedule_flush()
+
+    def put(self, namespace, key, value):
+        text = json.dumps(value)
+        self.snapshots.setdefault(namespace, {})[key] = text
+        self.pending[(namespace, key)] = text
+        self.schedule_flush()
+
+    def remove(self, namespace, key):
+        self.snapshots.setdefault(namespace, {}).pop(key, None)
+        self.pending[(namespace, key)] = None
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.commit()
+            return
+        self.flush_handle = loop.call_later(self.delay, lambda: loop.create_task(self.flush()))
+
+    def take_pending(self):
+        self.flush_handle = None
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def write(self, pending):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+                                        [(*key, value) for key, value in pending.items() if value is not None])
+            self.connection.executemany("DELETE FROM state WHERE namespace = ? AND key = ?",
+                                        [key for key, value in pending.items() if value is None])
+        self.commits += 1
+
+    def restore(self, pending, error):
+        # changes queued while the write was running are newer
+        self.pending = {**pending, **self.pending}
+        print(f"state write of {len(pending)} keys failed: {error!r}")
+
+    async def flush(self):
+        pending = self.take_pending()
+        if not pending:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.write, pending)
+        except Exception as e:
+            self.restore(pending, e)
+            self.schedule_flush()
+
+    def commit(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        pending = self.take_pending()
+        if pending:
+            try:
+                self.executor.submit(self.write, pending).result()
+            except Exception as e:
+                self.restore(pending, e)
+
+    def stats(self):
+        return {
+            "namespaces": len(self.snapshots),
+            "pending": len(self.pending),
+            "commits": self.commits
+        }
+
+
+def open_store(path, delay=1.0):
+    if path not in STORES:
+        STORES[path] = StateStore(path, delay)
+    return STORES[path]
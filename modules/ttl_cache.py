@@ -0,0 +1,90 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    """LRU cache of at most ``maxsize`` entries that expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self.data.get(key, MISSING)
+        if item is not MISSING and item[1] < time.monotonic():
+            del self.data[key]
+            item = MISSING
+        if item is MISSING:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self.data.pop(key, MISSING)
+        return default if item is MISSING else item[0]
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class CoalescingCache:
+    """TTLCache in front of a coroutine function.
+
+    Concurrent ``get`` calls for a key that is not cached yet share one
+    in-flight call. Results for which ``cacheable(result)`` is false and
+    exceptions are returned to the waiting callers but not stored.
+    """
+
+    def __init__(self, maxsize=1024, ttl=600, cacheable=None):
+        self.cache = TTLCache(maxsize, ttl)
+        self.cacheable = cacheable
+        self.pending = {}
+        self.coalesced = 0
+
+    async def get(self, key, func, *args, **kwargs):
+        value = self.cache.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        future = self.pending.get(key)
+        if future is None:
+            future = self.pending[key] = asyncio.ensure_future(func(*args, **kwargs))
+            future.add_done_callback(lambda done: self.finish(key, done))
+        else:
+            self.coalesced += 1
+        # a cancelled caller must not cancel the call the others wait for
+        return await asyncio.shield(future)
+
+    def finish(self, key, future):
+        self.pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if self.cacheable is None or self.cacheable(result):
+            self.cache.set(key, result)
+
+    def pop(self, key):
+        self.cache.pop(key)
+
+    def stats(self):
+        return {**self.cache.stats(), "coalesced": self.coalesced, "in flight": len(self.pending)}
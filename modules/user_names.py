@@ -0,0 +1,62 @@
+import asyncio
+
+from modules.ttl_cache import TTLCache
+from nextcord import HTTPException
+
+
+class UserNameResolver:
+    """Resolves user ids to names for leaderboards.
+
+    Names are taken from the gateway cache (guild members, then users) and
+    from a TTL cache of previous lookups. The remaining ids are fetched over
+    REST concurrently, at most ``concurrency`` requests at a time.
+    """
+
+    def __init__(self, client, cache_size=4096, ttl=3600, concurrency=4):
+        self.client = client
+        self.cache = TTLCache(cache_size, ttl)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.gateway_hits = 0
+        self.rest_calls = 0
+
+    async def fetch(self, user_id):
+        async with self.semaphore:
+            self.rest_calls += 1
+            try:
+                user = await self.client.fetch_user(user_id)
+            except HTTPException:
+                return None
+        name = str(user)
+        self.cache.set(user_id, name)
+        return name
+
+    async def resolve(self, guild, user_ids):
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            user = guild.get_member(user_id) if guild is not None else None
+            if user is None:
+                user = self.client.get_user(user_id)
+            if user is not None:
+                self.gateway_hits += 1
+                names[user_id] = str(user)
+                continue
+            name = self.cache.get(user_id)
+            if name is None:
+                missing.append(user_id)
+            else:
+                names[user_id] = name
+        fetched = await asyncio.gather(*(self.fetch(user_id) for user_id in missing))
+        for user_id, name in zip(missing, fetched):
+            names[user_id] = name if name is not None else str(user_id)
+        return names
+
+    def stats(self):
+        cache = self.cache.stats()
+        return {
+            "gateway hits": self.gateway_hits,
+            "cache hits": cache["hits"],
+            "cache misses": cache["misses"],
+            "cache size": cache["size"],
+            "rest calls": self.rest_calls
+        }
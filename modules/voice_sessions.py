@@ -0,0 +1,161 @@
+import asyncio
+
+from bson import ObjectId
+from nextcord.utils import utcnow
+from modules.write_buffer import DUPLICATE_KEY
+from pymongo import InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+def get_active_voice_users(guilds):
+    active_users = {}
+    for guild in guilds:
+        guild_active_users = {}
+        for channel in guild.voice_channels + guild.stage_channels:
+            for user in channel.members:
+                guild_active_users[user.id] = (user, channel)
+        active_users[guild.id] = guild_active_users
+    return active_users
+
+
+class VoiceSessionTracker:
+    """Voice sessions built from on_voice_state_update events.
+
+    A session document is inserted into voice_activity when a member joins
+    a channel and closed with ended_at and the exact activity_minutes when
+    they leave or move to another channel. Writes are queued in memory and
+    sent with one ordered bulk_write every ``flush_interval`` seconds; the
+    same flush refreshes last_seen of open sessions, which is used to close
+    them if the bot was stopped without closing its sessions.
+    """
+
+    def __init__(self, loop, collection, flush_interval=60):
+        self.loop = loop
+        self.collection = collection
+        self.flush_interval = flush_interval
+        # (guild_id, user_id) -> document of the open session
+        self.sessions = {}
+        self.pending = []
+        self.ready = False
+        self.lock = asyncio.Lock()
+        loop.create_task(self.flush_loop())
+
+    def open(self, member, channel, started_at):
+        item = {
+            "_id": ObjectId(),
+            "guild_id": member.guild.id,
+            "user_id": member.id,
+            "is_bot": member.bot,
+            "channel_id": channel.id,
+            "started_at": started_at,
+            "last_seen": started_at,
+            "ended_at": None,
+            "activity_minutes": 0,
+            "session_active": True
+        }
+        self.sessions[(member.guild.id, member.id)] = item
+        self.pending.append(InsertOne(item))
+
+    def close(self, guild_id, user_id, ended_at):
+        item = self.sessions.pop((guild_id, user_id), None)
+        if item is None:
+            return
+        minutes = (ended_at - item["started_at"]).total_seconds() / 60
+        self.pending.append(UpdateOne({"_id": item["_id"]}, {"$set": {
+            "ended_at": ended_at,
+            "last_seen": ended_at,
+            "activity_minutes": minutes,
+            "session_active": False
+        }}))
+
+    def update(self, member, before, after):
+        if before.channel == after.channel:
+            return
+        now = utcnow()
+        if before.channel is not None:
+            self.close(member.guild.id, member.id, now)
+        if after.channel is not None:
+            self.open(member, after.channel, now)
+
+    async def close_stale_sessions(self, open_ids):
+        # sessions left open by a previous run end at their last heartbeat
+        await self.collection.update_many(
+            {"session_active": True, "_id": {"$nin": open_ids}},
+            [{"$set": {"session_active": False,
+                       "ended_at": {"$ifNull": ["$last_seen", "$started_at"]}}},
+             {"$set": {"activity_minutes": {"$cond": [
+                 {"$eq": [{"$type": "$started_at"}, "date"]},
+                 {"$divide": [{"$subtract": ["$ended_at", "$started_at"]}, 60000]},
+                 "$activity_minutes"]}}}])
+
+    async def sync(self, guilds):
+        """Reconcile open sessions with the current voice states (on ready)."""
+        if not self.ready:
+            open_ids = [item["_id"] for item in self.sessions.values()]
+            await self.close_stale_sessions(open_ids)
+            self.ready = True
+        now = utcnow()
+        active_users = get_active_voice_users(guilds)
+        for guild_id, user_id in list(self.sessions):
+            if user_id not in active_users.get(guild_id, {}):
+                self.close(guild_id, user_id, now)
+        for guild_id, users in active_users.items():
+            for user_id, (user, channel) in users.items():
+                item = self.sessions.get((guild_id, user_id))
+                if item is not None and item["channel_id"] != channel.id:
+                    self.close(guild_id, user_id, now)
+                    item = None
+                if item is None:
+                    self.open(user, channel, now)
+
+    def take_operations(self):
+        operations, self.pending = self.pending, []
+        if self.sessions:
+            operations.append(UpdateMany(
+                {"_id": {"$in": [item["_id"] for item in self.sessions.values()]}},
+                {"$set": {"last_seen": utcnow()}}))
+        return operations
+
+    def requeue(self, operations):
+        # in front of everything queued while the write was running
+        self.pending[:0] = operations
+
+    async def flush(self):
+        # a close must not overtake the insert of its session in a concurrent write
+        async with self.lock:
+            await self.write()
+
+    async def write(self):
+        queued = len(self.pending)
+        operations = self.take_operations()
+        if not operations:
+            return
+        try:
+            await self.collection.bulk_write(operations, ordered=True)
+        except BulkWriteError as e:
+            # ordered, so the operations before the failed one are written; the failed
+            # one is either an insert that was written before or will never succeed
+            error = e.details["writeErrors"][0]
+            self.requeue(operations[error["index"] + 1:queued])
+            if error["code"] != DUPLICATE_KEY:
+                raise
+        except Exception:
+            self.requeue(operations[:queued])
+            raise
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"voice activity update failed: {e}")
+
+    def close_all(self):
+        """Close every open session and write the queue synchronously (shutdown)."""
+        now = utcnow()
+        for guild_id, user_id in list(self.sessions):
+            self.close(guild_id, user_id, now)
+        operations = self.take_operations()
+        if operations:
+            self.collection.sync.bulk_write(operations, ordered=True)
@@ -0,0 +1,244 @@
+import hashlib
+import re
+from collections import OrderedDict
+
+import numpy as np
+from bson import Binary
+from pymongo import ReplaceOne
+
+# mentions, custom emojis and links are skipped, only the captured group is a word
+TOKEN_PATTERN = re.compile(r"<a?:\w+:\d+>|<[@#&!]+\d+>|https?://\S+|(\w+)")
+
+
+def tokenize(text, min_length=3):
+    return [word for word in TOKEN_PATTERN.findall(text.lower())
+            if len(word) >= min_length and not word.isdigit()]
+
+
+class CountMinSketch:
+    """Approximate counters in a depth x width table; estimates never undercount."""
+
+    def __init__(self, width, depth, table=None):
+        self.width = width
+        self.depth = depth
+        self.rows = np.arange(depth)
+        self.table = np.zeros((depth, width), dtype=np.uint32) if table is None else table
+
+    def columns(self, word):
+        digest = hashlib.blake2b(word.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.width for i in range(self.depth)]
+
+    def add(self, word, count=1):
+        columns = self.columns(word)
+        self.table[self.rows, columns] += count
+        return int(self.table[self.rows, columns].min())
+
+    def estimate(self, word):
+        return int(self.table[self.rows, self.columns(word)].min())
+
+    def merge(self, other):
+        self.table += other.table
+
+
+class HeavyHitters:
+    """Count-min sketch with a bounded set of the most frequent words."""
+
+    def __init__(self, width, depth, capacity, sketch=None, top=None):
+        self.sketch = sketch or CountMinSketch(width, depth)
+        self.capacity = capacity
+        self.top = top or {}
+
+    def add(self, word):
+        estimate = self.sketch.add(word)
+        if word in self.top or len(self.top) < self.capacity:
+            self.top[word] = estimate
+            return
+        weakest = min(self.top, key=self.top.get)
+        if estimate > self.top[weakest]:
+            del self.top[weakest]
+            self.top[word] = estimate
+
+    def most_common(self, amount):
+        return sorted(self.top.items(), key=lambda item: -item[1])[:amount]
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        candidates = {word: self.sketch.estimate(word) for word in set(self.top) | set(other.top)}
+        self.top = dict(sorted(candidates.items(), key=lambda item: -item[1])[:self.capacity])
+
+    def to_document(self):
+        return {
+            "width": self.sketch.width,
+            "depth": self.sketch.depth,
+            "sketch": Binary(self.sketch.table.tobytes()),
+            "top": [[word, count] for word, count in self.top.items()]
+        }
+
+    @classmethod
+    def from_document(cls, document, capacity):
+        width, depth = document["width"], document["depth"]
+        table = np.frombuffer(document["sketch"], dtype=np.uint32).reshape(depth, width).copy()
+        return cls(width, depth, capacity, sketch=CountMinSketch(width, depth, table),
+                   top={word: count for word, count in document["top"]})
+
+
+class WordIndex:
+    """Most used words per guild (user_id None) and per guild member.
+
+    A guild takes ``4 * guild_width * depth`` bytes of memory and every
+    member ``4 * user_width * depth`` bytes. Guild entries are loaded by
+    ``load``; member entries are loaded when they are shown and at most
+    ``max_users`` of them are kept, least recently used ones are dropped
+    once persisted. An entry counted before its stored document was loaded
+    is merged with it on the next ``persist``, so a failed load never
+    overwrites stored counts. Changed entries are written to the
+    word_stats collection by ``persist``.
+    """
+
+    def __init__(self, collection, guild_width=8192, user_width=1024, depth=4,
+                 capacity=100, min_length=3, max_users=2000):
+        self.collection = collection
+        self.guild_width = guild_width
+        self.user_width = user_width
+        self.depth = depth
+        self.capacity = capacity
+        self.min_length = min_length
+        self.max_users = max_users
+        # (guild_id, None) -> HeavyHitters
+        self.guilds = {}
+        # (guild_id, user_id) -> HeavyHitters, least recently used first
+        self.users = OrderedDict()
+        # entries created without their stored document
+        self.partial = set()
+        self.dirty = set()
+        self.loaded = False
+
+    def entries(self, key):
+        return self.guilds if key[1] is None else self.users
+
+    def get(self, guild_id, user_id=None):
+        key = (guild_id, user_id)
+        entries = self.entries(key)
+        if key not in entries:
+            width = self.guild_width if user_id is None else self.user_width
+            entries[key] = HeavyHitters(width, self.depth, self.capacity)
+            self.partial.add(key)
+        if user_id is not None:
+            self.users.move_to_end(key)
+        return entries[key]
+
+    def add(self, guild_id, user_id, text):
+        words = tokenize(text, self.min_length)
+        if not words:
+            return
+        for key in ((guild_id, None), (guild_id, user_id)):
+            hitters = self.get(*key)
+            for word in words:
+                hitters.add(word)
+            self.dirty.add(key)
+        self.evict()
+
+    def evict(self):
+        # dirty entries stay until they are persisted
+        for key in list(self.users):
+            if len(self.users) <= self.max_users:
+                break
+            if key not in self.dirty:
+                del self.users[key]
+                self.partial.discard(key)
+
+    def merge(self, key, document):
+        hitters = HeavyHitters.from_document(document, self.capacity)
+        entries = self.entries(key)
+        if key in entries:
+            entries[key].merge(hitters)
+        else:
+            entries[key] = hitters
+        self.partial.discard(key)
+
+    async def most_common(self, guild_id, user_id=None, amount=15):
+        key = (guild_id, user_id)
+        entries = self.entries(key)
+        if key in self.partial or key not in entries and (user_id is not None or not self.loaded):
+            document = await self.collection.find_one({"guild_id": guild_id, "user_id": user_id})
+            if document is not None:
+                self.merge(key, document)
+            self.partial.discard(key)
+            self.evict()
+        hitters = entries.get(key)
+        if hitters is None:
+            return []
+        if user_id is not None:
+            self.users.move_to_end(key)
+        return hitters.most_common(amount)
+
+    async def load(self):
+        # merged, so words counted before the load finished are kept
+        counted = {key for key in self.guilds if key in self.partial}
+        for document in await self.collection.find({"user_id": None}):
+            key = (document["guild_id"], None)
+            # skip entries already merged by most_common
+            if key not in self.guilds or key in self.partial:
+                self.merge(key, document)
+        self.partial -= counted
+        self.loaded = True
+
+    @staticmethod
+    def partial_query(keys):
+        return {"$or": [{"guild_id": guild_id, "user_id": user_id} for guild_id, user_id in keys]}
+
+    def take_operations(self, checked=(), documents=()):
+        """Merge the stored documents of the ``checked`` partial entries and take the writes."""
+        for document in documents:
+            key = (document["guild_id"], document["user_id"])
+            if key in self.partial:
+                self.merge(key, document)
+        self.partial -= set(checked)
+        keys, self.dirty = self.dirty, set()
+        return keys, [ReplaceOne({"guild_id": guild_id, "user_id": user_id},
+                                 {"guild_id": guild_id, "user_id": user_id,
+                                  **self.entries((guild_id, user_id))[(guild_id, user_id)].to_document()},
+                                 upsert=True)
+                      for guild_id, user_id in keys if (guild_id, user_id) in self.entries((guild_id, user_id))]
+
+    async def persist(self):
+        partial = self.partial & self.dirty
+        documents = await self.collection.find(self.partial_query(partial)) if partial else []
+        keys, operations = self.take_operations(partial, documents)
+        if not operations:
+            return
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except Exception:
+            # written again with the next persist
+            self.dirty |= keys
+            raise
+        self.evict()
+
+    def close(self):
+        partial = self.partial & self.dirty
+        documents = list(self.collection.sync.find(self.partial_query(partial))) if partial else []
+        _, operations = self.take_operations(partial, documents)
+        if operations:
+            self.collection.sync.bulk_write(operations, ordered=False)
+
+    async def rebuild(self, guild_id, messages, batch_size=1000):
+        """Recount a guild from the messages collection, one cursor batch at a time."""
+        self.guilds.pop((guild_id, None), None)
+        for key in [key for key in self.users if key[0] == guild_id]:
+            self.users.pop(key)
+        self.dirty = {key for key in self.dirty if key[0] != guild_id}
+        self.partial = {key for key in self.partial if key[0] != guild_id}
+        await self.collection.delete_many({"guild_id": guild_id})
+        count = 0
+        async for batch in messages.find_batches({"guild_id": guild_id, "is_bot": False},
+                                                 ["author_id", "content"], batch_size=batch_size):
+            for item in batch:
+                self.add(guild_id, item["author_id"], item.get("content") or "")
+            count += len(batch)
+            if len(self.users) > self.max_users:
+                await self.persist()
+        await self.persist()
+        return count
@@ -0,0 +1,156 @@
+import asyncio
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+
+class WriteBuffer:
+    """Collects documents and writes them to an AsyncCollection with insert_many.
+
+    A batch is flushed when it reaches ``batch_size`` documents or when
+    ``flush_interval`` seconds passed since its first document. The queue is
+    bounded by ``max_size``: producers wait up to ``put_timeout`` seconds for
+    free space and the document is dropped after that. Documents rejected by
+    a unique index are counted as duplicates.
+    """
+
+    def __init__(self, loop, collection, batch_size=500, flush_interval=1.0,
+                 max_size=10000, put_timeout=0.5):
+        self.loop = loop
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue = asyncio.Queue(max_size)
+        self.batch = []
+        self.lock = asyncio.Lock()
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.task = loop.create_task(self.run())
+
+    async def put(self, document):
+        try:
+            self.queue.put_nowait(document)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self.queue.put(document), self.put_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                return False
+        self.queued += 1
+        return True
+
+    async def run(self):
+        while True:
+            # kept on self, so close() writes a batch that is still being collected
+            self.batch.append(await self.queue.get())
+            deadline = self.loop.time() + self.flush_interval
+            while len(self.batch) < self.batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self.batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            batch, self.batch = self.batch, []
+            await self.write(batch)
+
+    async def write(self, batch):
+        async with self.lock:
+            if not batch:
+                return
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+                self.flushed += len(batch)
+            except BulkWriteError as e:
+                self.count_errors(batch, e)
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f"failed to write {len(batch)} documents: {e}")
+
+    def take(self):
+        batch, self.batch = self.batch, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def flush(self):
+        """Write everything queued so far, including a batch that is being written."""
+        await self.write(self.take())
+
+    def count_errors(self, batch, error):
+        errors = error.details["writeErrors"]
+        duplicates = sum(item["code"] == DUPLICATE_KEY for item in errors)
+        self.duplicates += duplicates
+        self.dropped += len(errors) - duplicates
+        self.flushed += len(batch) - len(errors)
+        if duplicates < len(errors):
+            print(f"failed to write {len(errors) - duplicates} documents: {errors[0]['errmsg']}")
+
+    def close(self):
+        """Stop the writer and synchronously write everything left in the queue."""
+        self.task.cancel()
+        batch = self.take()
+        if batch:
+            try:
+                self.collection.sync.insert_many(batch, ordered=False)
+                self.flushed += len(batch)
+            except BulkWriteError as e:
+                self.count_errors(batch, e)
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "pending": self.queue.qsize() + len(self.batch)
+        }
+
+
+class IncrementBuffer:
+    """Accumulates $inc updates in memory and upserts them with one bulk_write.
+
+    Keys are tuples of the values of ``key_fields`` that identify the
+    document, values are dicts of counters to increment.
+    """
+
+    def __init__(self, collection, key_fields):
+        self.collection = collection
+        self.key_fields = key_fields
+        self.pending = {}
+
+    def add(self, key, **counters):
+        pending = self.pending.setdefault(key, {})
+        for name, value in counters.items():
+            pending[name] = pending.get(name, 0) + value
+
+    def take(self, match=None):
+        keys = [key for key in self.pending if match is None or match(key)]
+        return {key: self.pending.pop(key) for key in keys}
+
+    def operations(self, pending):
+        return [UpdateOne(dict(zip(self.key_fields, key)), {"$inc": counters}, upsert=True)
+                for key, counters in pending.items()]
+
+    async def flush(self, match=None):
+        pending = self.take(match)
+        if not pending:
+            return
+        try:
+            await self.collection.bulk_write(self.operations(pending), ordered=False)
+        except Exception:
+            # keep increments in memory and retry on the next flush
+            for key, counters in pending.items():
+                self.add(key, **counters)
+            raise
+
+    def close(self):
+        pending = self.take()
+        if pending:
+            self.collection.sync.bulk_write(self.operations(pending), ordered=False)